@@ -0,0 +1,182 @@
+# .. -*- coding: utf-8 -*-
+#
+# ********************************************************
+# autograder.py -- Grade a class's homework 1 submissions.
+# ********************************************************
+# This program runs each test in ``TestPickVal`` (from the ``hw1.py`` in this directory) against the ``pick_val`` in each of many submitted files, then prints a table of results. For example::
+#
+#    python autograder.py submissions/*.py
+#
+# Each test of each submission runs in its own process, with as many processes running at once as there are CPU cores. A test which runs past its time limit is killed, and each process is limited in the memory it may use, so an infinite loop or a crash in one student's code only fails that test, rather than stalling or killing the whole batch.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+from __future__ import print_function
+import argparse
+import os
+import sys
+import time
+import traceback
+from multiprocessing import Pipe, Process, cpu_count
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; memory limits are then skipped.
+    resource = None
+#
+# Local imports
+# -------------
+# The reference tests.
+import hw1
+#
+#
+# Loading submissions
+# ===================
+# Load the Python file at ``path`` as a module named ``name``.
+def load_module(name, path):
+    try:
+        from importlib.util import spec_from_file_location, module_from_spec
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# The names of the tests to run, in order.
+def test_names():
+    return sorted(name for name in dir(hw1.TestPickVal)
+      if name.startswith('test_'))
+#
+#
+# Running one test
+# ================
+# This runs in a child process: load the submission, point the reference tests at its ``pick_val``, run one test, then send (status, detail, seconds) back through ``conn``.
+def _run_test(path, test_name, memory_mb, conn):
+    if resource and memory_mb:
+        limit = memory_mb*1024*1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    # Don't let the submission's output clutter the table.
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    try:
+        submission = load_module('submission', path)
+        hw1.pick_val = submission.pick_val
+        getattr(hw1.TestPickVal(), test_name)()
+        result = ('pass', '')
+    except AssertionError:
+        result = ('fail', traceback.format_exc().strip().splitlines()[-1])
+    except MemoryError:
+        result = ('memory', 'MemoryError')
+    except BaseException as e:
+        result = ('error', '{}: {}'.format(type(e).__name__, e))
+    conn.send(result + (time.time() - start,))
+    conn.close()
+
+# A test running in a child process.
+class _Job(object):
+    def __init__(self, path, test_name, timeout, memory_mb):
+        self.path = path
+        self.test_name = test_name
+        self.timeout = timeout
+        self._conn, child_conn = Pipe(False)
+        self._process = Process(target=_run_test,
+          args=(path, test_name, memory_mb, child_conn))
+        self._process.daemon = True
+        self._start = time.time()
+        self._process.start()
+        child_conn.close()
+
+    # Return (status, detail, seconds) once the test is done, or None while it's still running.
+    def poll(self):
+        elapsed = time.time() - self._start
+        # Check whether the test exited before looking for its result; checking in the other order misses a result sent just before the test exits.
+        exited = not self._process.is_alive()
+        if self._conn.poll():
+            try:
+                result = self._conn.recv()
+            except EOFError:
+                result = None
+            self._process.join()
+            if result:
+                return result
+            return ('crash', 'exit code {}'.format(self._process.exitcode), elapsed)
+        if exited:
+            self._process.join()
+            return ('crash', 'exit code {}'.format(self._process.exitcode), elapsed)
+        if elapsed > self.timeout:
+            self._process.terminate()
+            self._process.join()
+            return ('timeout', 'over {} s'.format(self.timeout), elapsed)
+        return None
+#
+#
+# Grading
+# =======
+# Run every test on every submission, keeping ``jobs`` processes busy. Returns a dict mapping (path, test_name) to (status, detail, seconds).
+def grade(paths, timeout=2.0, memory_mb=256, jobs=None):
+    pending = [(path, name) for path in paths for name in test_names()]
+    pending.reverse()
+    running = []
+    results = {}
+    jobs = jobs or cpu_count()
+    while pending or running:
+        while pending and len(running) < jobs:
+            path, name = pending.pop()
+            running.append(_Job(path, name, timeout, memory_mb))
+        still_running = []
+        for job in running:
+            result = job.poll()
+            if result is None:
+                still_running.append(job)
+            else:
+                results[(job.path, job.test_name)] = result
+        if len(still_running) == len(running):
+            time.sleep(0.005)
+        running = still_running
+    return results
+
+# Print one row per submission, giving each test's status and time in ms, then the number of tests passed.
+def print_table(paths, results):
+    names = test_names()
+    width = max([len(os.path.basename(p)) for p in paths] + [len('submission')])
+    print('{:<{}}'.format('submission', width) +
+      ''.join('{:>16}'.format(name) for name in names) + '{:>8}'.format('passed'))
+    for path in paths:
+        row = [results[(path, name)] for name in names]
+        cells = ''.join('{:>16}'.format('{} {:.0f}ms'.format(status, seconds*1000))
+          for status, detail, seconds in row)
+        passed = sum(status == 'pass' for status, detail, seconds in row)
+        print('{:<{}}'.format(os.path.basename(path), width) + cells +
+          '{:>8}'.format('{}/{}'.format(passed, len(names))))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Grade hw1 submissions.')
+    parser.add_argument('submissions', nargs='+',
+      help='The submitted hw1.py files.')
+    parser.add_argument('--timeout', type=float, default=2.0,
+      help='The time limit for each test, in seconds (default: %(default)s).')
+    parser.add_argument('--memory', type=int, default=256,
+      help='The memory limit for each test, in MB; 0 for none (default: %(default)s).')
+    parser.add_argument('--jobs', type=int, default=cpu_count(),
+      help='The number of tests to run at once (default: %(default)s).')
+    parser.add_argument('-v', '--verbose', action='store_true',
+      help='Also print why each failing test failed.')
+    args = parser.parse_args(argv)
+
+    paths = [os.path.abspath(p) for p in args.submissions]
+    results = grade(paths, args.timeout, args.memory, args.jobs)
+    print_table(paths, results)
+    if args.verbose:
+        for path in paths:
+            for name in test_names():
+                status, detail, seconds = results[(path, name)]
+                if status != 'pass':
+                    print('{} {}: {} {}'.format(os.path.basename(path), name,
+                      status, detail))
+
+if __name__ == '__main__':
+    main()
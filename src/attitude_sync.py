@@ -0,0 +1,84 @@
+# .. -*- coding: utf-8 -*-
+#
+# *********************************************************************
+# attitude_sync.py - Compensate image positions for the drone's attitude
+# *********************************************************************
+# The front camera is fixed to the drone, so whenever the drone pitches or rolls, the whole image moves -- and the tracked car appears to move with it, even if it's standing still. Without compensation, ``fly`` chases the drone's own motion. This module:
+#
+# - Keeps a time-indexed buffer of navdata attitude samples, so that each video frame can be matched with the sample nearest its timestamp by binary search.
+# - Converts an image position into the position it would have in an image taken by a level camera, by turning it into a bearing (azimuth and elevation angles), removing the measured roll and pitch, then projecting it back. Positions stay in pixels, so ``fly`` needn't change.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+from __future__ import division
+import threading
+from math import atan, atan2, cos, hypot, radians, sin, tan
+#
+# Third-party imports
+# -------------------
+import numpy as np
+#
+#
+# NavdataBuffer
+# =============
+class NavdataBuffer(object):
+    def __init__(self,
+      # The number of recent samples to keep. Navdata arrives at up to 200 Hz, so the default covers over a second.
+      capacity=256):
+
+        self.capacity = capacity
+        # Samples are appended to arrays twice ``capacity`` long; when they fill, the newest ``capacity`` samples move to the front. The valid samples, ``[_start:_end]``, are always contiguous and in time order, ready for ``searchsorted``.
+        self._time = np.zeros(2*capacity)
+        self._data = np.zeros((2*capacity, 2))
+        self._start = self._end = 0
+        self._lock = threading.Lock()
+
+    # Add a sample, given its time in seconds and the roll and pitch in degrees (navdata ``rotX`` and ``rotY``). Samples must arrive in time order.
+    def add(self, stamp, roll, pitch):
+        with self._lock:
+            if self._end == len(self._time):
+                keep = slice(self._end - self.capacity, self._end)
+                self._time[:self.capacity] = self._time[keep]
+                self._data[:self.capacity] = self._data[keep]
+                self._start, self._end = 0, self.capacity
+            self._time[self._end] = stamp
+            self._data[self._end] = (roll, pitch)
+            self._end += 1
+            self._start = max(self._start, self._end - self.capacity)
+
+    # Return the (roll, pitch) sample nearest in time to ``stamp``, or None if there is no sample within ``max_age`` seconds.
+    def nearest(self, stamp, max_age=0.1):
+        with self._lock:
+            times = self._time[self._start:self._end]
+            if not len(times):
+                return None
+            i = np.searchsorted(times, stamp)
+            # The nearest sample is either just before or just after ``stamp``.
+            if i == len(times) or (i > 0 and
+                stamp - times[i - 1] <= times[i] - stamp):
+                i -= 1
+            if abs(times[i] - stamp) > max_age:
+                return None
+            return tuple(float(v) for v in self._data[self._start + i])
+#
+#
+# Attitude compensation
+# =====================
+# Return the (x, y) position at which a level camera would have seen the point imaged at (``x``, ``y``), given the camera's ``roll`` and ``pitch`` in degrees. ``size`` is the (width, height) of the image, and ``fov_x`` the camera's horizontal field of view in degrees. Roll is positive when the drone banks right and pitch positive when its nose rises; use ``roll_sign`` and ``pitch_sign`` (``ButtonGui.CAMERA_ROLL_SIGN`` and ``CAMERA_PITCH_SIGN``) to convert from the navdata convention, which hasn't yet been checked on the drone. The result may lie outside the image.
+def level_position(x, y, roll, pitch, size, fov_x, roll_sign=1, pitch_sign=1):
+    width, height = size
+    cx, cy = (width - 1)/2, (height - 1)/2
+    f = (width/2)/tan(radians(fov_x)/2)
+    # When the camera rolls right, the image rotates left around its center; undo that rotation.
+    r = radians(roll_sign*roll)
+    dx, dy = x - cx, y - cy
+    dx, dy = dx*cos(r) - dy*sin(r), dx*sin(r) + dy*cos(r)
+    # Convert to a bearing: azimuth right of the optical axis, and elevation below it. When the nose rises, objects appear lower in the image, so subtract the pitch to get the elevation below the horizon.
+    azimuth = atan(dx/f)
+    elevation = atan2(dy, hypot(f, dx)) - radians(pitch_sign*pitch)
+    # Project the bearing back into the level camera.
+    x_level = cx + f*tan(azimuth)
+    y_level = cy + hypot(f, f*tan(azimuth))*tan(elevation)
+    return x_level, y_level
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# .. -*- coding: utf-8 -*-
+#
+# *******************************************************************
+# bus_benchmark.py - Flood the controller and video with synthetic data
+# *******************************************************************
+# This program runs ``BasicDroneController`` and ``RosVideo`` on a :class:`transport.FakeBus`, with no roscore or drone. It floods them with navdata and frames in virtual time while a simple tracker (:func:`webcam_find_car.find_car`, then ``SetCommand``) runs on each frame. Then it reports:
+#
+# - How many messages of each kind were published and received.
+# - The latency, in virtual time, from each frame to the first ``/cmd_vel`` command carrying its result. Processing takes no virtual time, so this measures how long the command loop holds a new command before sending it; it's identical on every run.
+# - The wall-clock time per frame, which measures the cost of the message path and tracking.
+#
+# Run it with ``python bus_benchmark.py``; it needs the ROS message packages, but not a running ROS system.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+from __future__ import print_function, division
+from bisect import bisect_right
+from timeit import default_timer
+#
+# Third-party imports
+# -------------------
+import cv2
+import genpy
+import numpy as np
+from ardrone_autonomy.msg import Navdata
+from cv_bridge import CvBridge
+#
+# Local imports
+# -------------
+from transport import FakeBus
+from drone_controller import BasicDroneController
+from drone_status import DroneStatus
+from metrics import REGISTRY
+from mav_control_base import RosVideo
+from webcam_find_car import find_car
+
+# The color and threshold searched for.
+COLOR = np.array([1, 0, 0], dtype=np.float32)
+THRESH = 0.5
+
+# Create ``count`` frames of ``size`` with a target-colored blob moving across a noisy background.
+def synthetic_frames(count, size=(640, 360), seed=0):
+    width, height = size
+    rng = np.random.RandomState(seed)
+    background = rng.randint(0, 128, (height, width, 3)).astype(np.uint8)
+    bridge = CvBridge()
+    for i in range(count):
+        image = background.copy()
+        x = int(width*(0.2 + 0.6*i/max(count - 1, 1)))
+        cv2.circle(image, (x, height//2), height//10, (255, 0, 0), -1)
+        yield bridge.cv2_to_imgmsg(image, 'rgb8')
+
+# Return a navdata message reporting the drone flying level.
+def flying_navdata(stamp):
+    navdata = Navdata()
+    navdata.header.stamp = genpy.Time.from_sec(stamp)
+    navdata.state = DroneStatus.Flying
+    navdata.batteryPercent = 100.0
+    return navdata
+
+def set_stamp(msg, now):
+    msg.header.stamp = genpy.Time.from_sec(now)
+
+def main(frames=300, frame_rate=30.0, navdata_rate=200.0):
+    bus = FakeBus()
+    controller = BasicDroneController(bus)
+    # Publish navdata from a virtual timer, so it interleaves with frames.
+    bus.timer(1.0/navdata_rate, lambda event:
+      bus.publish('/ardrone/navdata', flying_navdata(bus.time)))
+
+    # Steer toward the blob on each frame.
+    received = [0]
+    def on_frame(header, image, image_scale):
+        received[0] += 1
+        view_image, cont_image, center, area = find_car(image, COLOR, THRESH)
+        if center != (-1, -1):
+            controller.SetCommand(roll=-(center[0]/image.shape[1] - 0.5))
+    video = RosVideo(bus)
+    video.videoFrame.connect(on_frame)
+    video.run()
+
+    start = default_timer()
+    published = bus.flood('/ardrone/image_raw', synthetic_frames(frames),
+      frame_rate, set_stamp)
+    elapsed = default_timer() - start
+    video.stop()
+
+    # Match each frame with the first command sent after it. Timers due at a frame's time fire before the frame is published, so a command at the same virtual time predates it.
+    frame_times = bus.publish_times['/ardrone/image_raw']
+    command_times = bus.publish_times.get('/cmd_vel', [])
+    latencies = []
+    for t in frame_times:
+        i = bisect_right(command_times, t)
+        if i < len(command_times):
+            latencies.append((command_times[i] - t)*1000.0)
+
+    print('Frames: {} published, {} received.'.format(published, received[0]))
+    print('Navdata: {} published, {} received.'.format(
+      bus.published.get('/ardrone/navdata', 0),
+      REGISTRY.counter('drone_navdata_received_total',
+      'Navdata messages received.').value))
+    print('Commands: {} sent in {:.1f} virtual s.'.format(len(command_times),
+      bus.time))
+    if latencies:
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print('Frame to command latency (virtual ms): p50 {:.1f}, p99 {:.1f}, '
+          'max {:.1f}.'.format(p50, p99, max(latencies)))
+    print('Wall time: {:.2f} ms/frame ({:.1f} frames/s).'.format(
+      elapsed*1000.0/published, published/elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# .. -*- coding: utf-8 -*-
+#
+# *****************************************************************
+# camera_model.py - Correct tracked positions for lens distortion
+# *****************************************************************
+# The AR.Drone's front camera has a wide-angle lens, which bends straight lines and pulls points near the edges of the image toward its center. A centroid from :func:`webcam_find_car.compute_mass_center` near an edge is therefore misplaced, and ``fly`` overcorrects. Undistorting every frame would cost far more than the rest of the pipeline; instead, this module undistorts only the points which matter (the centroid, and optionally contour points). The full-image remap is computed once, and only if an undistorted display is requested.
+#
+# Calibrations are read from the `camera_info YAML files <http://wiki.ros.org/camera_calibration_parsers>`_ written by the ROS ``camera_calibration`` package, which ``ardrone_autonomy`` looks for in ``~/.ros/camera_info``. Each camera's file is read once, then cached. A camera with no calibration file is left uncorrected; no default calibration is guessed.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+from os.path import exists, expanduser, join
+#
+# Third-party imports
+# -------------------
+import cv2
+import numpy as np
+import yaml
+#
+#
+# CameraModel
+# ===========
+class CameraModel(object):
+    def __init__(self,
+      # The 3x3 camera matrix, for images of ``size``.
+      camera_matrix,
+      # The distortion coefficients, in the order OpenCV uses.
+      dist_coeffs,
+      # The (width, height) of the calibration images.
+      size):
+
+        self.camera_matrix = np.asarray(camera_matrix, np.float64).reshape(3, 3)
+        self.dist_coeffs = np.asarray(dist_coeffs, np.float64).ravel()
+        self.size = tuple(size)
+        # Camera matrices and remap tables, computed when first needed for each image size.
+        self._matrices = {}
+        self._maps = {}
+
+    # Return the camera matrix for images of ``size``, which may be scaled from the calibration size (as ``ButtonGui`` scales video for display).
+    def matrix(self, size):
+        K = self._matrices.get(size)
+        if K is None:
+            K = self.camera_matrix.copy()
+            K[0] *= size[0]/float(self.size[0])
+            K[1] *= size[1]/float(self.size[1])
+            self._matrices[size] = K
+        return K
+
+    # Return an N by 2 array giving the undistorted position of each of ``points`` (an N by 2 array, or a contour) in an image of ``size``. Undistorted points stay in pixels of the same image.
+    def undistort_points(self, points, size):
+        points = np.asarray(points, np.float64).reshape(-1, 1, 2)
+        K = self.matrix(size)
+        return cv2.undistortPoints(points, K, self.dist_coeffs, P=K).reshape(-1, 2)
+
+    # Return the undistorted position of the point (``x``, ``y``) in an image of ``size``.
+    def undistort_point(self, x, y, size):
+        return tuple(float(v) for v in self.undistort_points([(x, y)], size)[0])
+
+    # Return an undistorted copy of ``image``. The remap tables for each image size are computed on the first call, then reused.
+    def undistort_image(self, image):
+        size = (image.shape[1], image.shape[0])
+        maps = self._maps.get(size)
+        if maps is None:
+            K = self.matrix(size)
+            maps = self._maps[size] = cv2.initUndistortRectifyMap(K,
+              self.dist_coeffs, None, K, size, cv2.CV_16SC2)
+        return cv2.remap(image, maps[0], maps[1], cv2.INTER_LINEAR)
+#
+#
+# Loading calibrations
+# ====================
+# The calibration file for each camera channel, as selected by ``BasicDroneController.SetCamera``.
+CAMERA_INFO_PATHS = {
+  0: join(expanduser('~'), '.ros', 'camera_info', 'ardrone_front.yaml'),
+  1: join(expanduser('~'), '.ros', 'camera_info', 'ardrone_bottom.yaml'),
+}
+
+# Read a ``CameraModel`` from the camera_info YAML file at ``path``.
+def load_camera_info(path):
+    with open(path) as f:
+        info = yaml.safe_load(f)
+    return CameraModel(info['camera_matrix']['data'],
+      info['distortion_coefficients']['data'],
+      (info['image_width'], info['image_height']))
+
+# Models already loaded, indexed by camera channel.
+_models = {}
+
+# Return the ``CameraModel`` for camera ``channel``, or None if it has no calibration file. Each file is read only once.
+def camera_model(channel):
+    if channel not in _models:
+        path = CAMERA_INFO_PATHS.get(channel)
+        _models[channel] = (load_camera_info(path)
+          if path and exists(path) else None)
+    return _models[channel]
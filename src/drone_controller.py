@@ -21,12 +21,14 @@
 #
 # Library imports
 # ---------------
-# None needed.
+import os
+import threading
+import time
 #
 # Third-party imports
 # -------------------
-# Import the ROS libraries.
-import rospy
+# NumPy holds recent command loop intervals.
+import numpy as np
 # Import the messages we're interested in sending and
 # receiving:
 #
@@ -47,6 +49,12 @@ from ardrone_autonomy.srv import CamSelect, \
 # -------------
 # An enumeration of Drone Status.
 from drone_status import DroneStatus
+# Recent attitude, indexed by time.
+from attitude_sync import NavdataBuffer
+# Send and receive messages through ROS or an in-process bus.
+from transport import RospyTransport
+# Rates and times reported to outside monitoring.
+from metrics import REGISTRY
 #
 #
 # BasicDroneController
@@ -55,10 +63,31 @@ from drone_status import DroneStatus
 class BasicDroneController(object):
     # Some Constants.
     COMMAND_PERIOD = 100 #ms
+    # If ``FeedWatchdog`` isn't called for this long while the
+    # watchdog is armed, the drone is commanded to hover.
+    WATCHDOG_DEADLINE = 500 #ms
+    # True to send commands from a dedicated thread, which
+    # tries to obtain real-time priority, instead of a
+    # ``rospy.Timer``.
+    COMMAND_THREAD = False
+    # The number of recent command loop intervals kept for
+    # ``CommandLoopJitter``.
+    JITTER_HISTORY = 1000
 
-    def __init__(self):
+    def __init__(self,
+      # The ``transport`` used to send and receive messages;
+      # by default, ROS.
+      transport=None):
+
+        self.transport = transport = transport or RospyTransport()
         # Holds the current drone status.
         self.status = -1
+        # Holds recent attitude, so video frames
+        # can be matched with the attitude when they were taken.
+        self.navdata = NavdataBuffer()
+        # The drone's battery charge, in percent, or None if
+        # not yet known.
+        self.batteryPercent = None
 
         # Proivde services
         # ----------------
@@ -70,37 +99,41 @@ class BasicDroneController(object):
         # <http://ardrone-autonomy.readthedocs.org/en/latest/services.html#toggle-camera>`_
         toggle_camera = '/ardrone/togglecam'
         #rospy.wait_for_service(toggle_camera)
-        self.ToggleCamera = rospy.ServiceProxy(
+        self._toggleCamera = transport.service_proxy(
           toggle_camera, EmptyServiceType)
         # Set camera channel (see link above).
         set_camera_channel = '/ardrone/setcamchannel'
         #rospy.wait_for_service(set_camera_channel)
-        self.SetCamera = rospy.ServiceProxy(
+        self._setCamera = transport.service_proxy(
           set_camera_channel, CamSelect)
+        # The camera sending video: 0 for the front camera, 1
+        # for the bottom camera. The driver starts with the
+        # front camera.
+        self.cameraChannel = 0
         # `LED animations
         # <http://ardrone-autonomy.readthedocs.org/en/latest/services.html#led-animations>`_
         led_animations = '/ardrone/setledanimation'
         #rospy.wait_for_service(led_animations)
-        self.SetLedAnimation = rospy.ServiceProxy(
+        self.SetLedAnimation = transport.service_proxy(
           led_animations, LedAnim)
         # 'Flight animations
         # <http://ardrone-autonomy.readthedocs.org/en/latest/services.html#flight-animations>`_
         # Be careful with these!
         flight_animations = '/ardrone/setflightanimation'
         #rospy.wait_for_service(flight_animations)
-        self.SetFlightAnimation = rospy.ServiceProxy(
+        self.SetFlightAnimation = transport.service_proxy(
           flight_animations, FlightAnim)
         # `Flat trim
         # <http://ardrone-autonomy.readthedocs.org/en/latest/services.html#flat-trim>`_
         flat_trim = '/ardrone/flattrim'
         #rospy.wait_for_service(flat_trim)
-        self.SetFlatTrim = rospy.ServiceProxy(flat_trim,
+        self.SetFlatTrim = transport.service_proxy(flat_trim,
           EmptyServiceType)
         # `Record to USB stick
         # <http://ardrone-autonomy.readthedocs.org/en/latest/services.html#record-to-usb-stick>`_
         record_usb = '/ardrone/setrecord'
         #rospy.wait_for_service(record_usb)
-        self.RecordUsb = rospy.ServiceProxy(record_usb,
+        self.RecordUsb = transport.service_proxy(record_usb,
           RecordEnable)
 
         # Takeoff, land, and reset
@@ -108,36 +141,89 @@ class BasicDroneController(object):
         # Allow the controller to publish to the
         # ``/ardrone/takeoff``, ``land`` and ``reset``
         # topics.
-        self.pubLand = rospy.Publisher('/ardrone/land',
+        self.pubLand = transport.publisher('/ardrone/land',
           Empty, queue_size=10)
-        self.pubTakeoff = rospy.Publisher('/ardrone/takeoff',
+        self.pubTakeoff = transport.publisher('/ardrone/takeoff',
           Empty, queue_size=10)
-        self.pubReset = rospy.Publisher('/ardrone/reset',
+        self.pubReset = transport.publisher('/ardrone/reset',
           Empty, queue_size=10)
 
         # Velocity
         # --------
         # Allow the controller to publish to the
         # ``/cmd_vel`` topic and thus control the drone.
-        self.pubCommand = rospy.Publisher('/cmd_vel',
+        self.pubCommand = transport.publisher('/cmd_vel',
           Twist, queue_size=10)
 
         # Subscribe to the ``/ardrone/navdata`` topic, of
         # message type navdata, and call
         # ``self.ReceiveNavdata`` when a message is
         # received.
-        self.subNavdata = rospy.Subscriber('/ardrone/navdata',
+        self.subNavdata = transport.subscriber('/ardrone/navdata',
           Navdata, self._ReceiveNavdata)
 
-        # Set up regular publishing of control packets.
         self.command = Twist()
-        self.commandTimer = rospy.Timer(rospy.Duration(
-          self.COMMAND_PERIOD/1000.0), self._SendCommand)
+
+        # Metrics
+        # -------
+        # Count commands and navdata messages, and accumulate
+        # the time spent in each status; see ``metrics``.
+        self._commandsSent = REGISTRY.counter(
+          'drone_commands_sent_total',
+          'Flight commands published to /cmd_vel.')
+        self._navdataReceived = REGISTRY.counter(
+          'drone_navdata_received_total',
+          'Navdata messages received.')
+        self._statusSeconds = dict((value, REGISTRY.counter(
+          'drone_status_seconds_total',
+          'Time spent in each drone status.', status=name))
+          for name, value in vars(DroneStatus).items()
+          if not name.startswith('_'))
+        self._unknownStatusSeconds = REGISTRY.counter(
+          'drone_status_seconds_total',
+          'Time spent in each drone status.', status='Unknown')
+        # The time the last navdata message arrived.
+        self._lastNavdataTime = None
+        # Measure the interval between runs of the command
+        # loop, in seconds.
+        self._commandIntervalSeconds = REGISTRY.histogram(
+          'drone_command_interval_seconds',
+          'Time between runs of the command loop.',
+          buckets=(0.09, 0.095, 0.099, 0.101, 0.105, 0.11, 0.125,
+                   0.15, 0.2, 0.5))
+        self._watchdogTrips = REGISTRY.counter(
+          'drone_watchdog_trips_total',
+          'Times the command watchdog forced a hover.')
+
+        # Command loop
+        # ------------
+        # A ring buffer of the most recent command loop
+        # intervals, the number of intervals recorded, and the
+        # time the loop last ran.
+        self._intervals = np.zeros(self.JITTER_HISTORY)
+        self._intervalCount = 0
+        self._lastSendTime = None
+        # The watchdog is armed by ``FeedWatchdog`` and disarmed
+        # by ``DisarmWatchdog`` or when it trips.
+        self._lastFeedTime = None
+        # Functions called, with the time in seconds since the
+        # last feed, when the watchdog trips.
+        self.watchdogHandlers = []
+
+        # Set up regular publishing of control packets.
+        if self.COMMAND_THREAD:
+            self.commandThread = threading.Thread(
+              target=self._CommandLoop)
+            self.commandThread.daemon = True
+            self.commandThread.start()
+        else:
+            self.commandTimer = transport.timer(
+              self.COMMAND_PERIOD/1000.0, self._SendCommand)
 
         # Shutdown
         # --------
         # Land the drone when we shut down.
-        rospy.on_shutdown(self.SendLand)
+        transport.on_shutdown(self.SendLand)
 
     # Send a takeoff message to the ardrone driver.
     def SendTakeoff(self):
@@ -157,6 +243,19 @@ class BasicDroneController(object):
     def SendEmergency(self):
         self.pubReset.publish(Empty())
 
+    # Switch between the front and bottom cameras.
+    def ToggleCamera(self):
+        response = self._toggleCamera()
+        self.cameraChannel = 1 - self.cameraChannel
+        return response
+
+    # Select a camera: 0 for the front camera, 1 for the
+    # bottom camera.
+    def SetCamera(self, channel):
+        response = self._setCamera(channel)
+        self.cameraChannel = channel
+        return response
+
     # Define the flight command which will be sent to the
     # drone. All the commands accept values between -1 and
     # 1. A value of 0 commands no motion.
@@ -181,6 +280,30 @@ class BasicDroneController(object):
     def hover(self):
         self.SetCommand(0, 0, 0, 0)
 
+    # Report that the command reflects fresh information
+    # (for example, ``fly`` just ran on a new video frame).
+    # This arms the watchdog: if not called again within
+    # ``WATCHDOG_DEADLINE``, the drone hovers.
+    def FeedWatchdog(self):
+        self._lastFeedTime = self.transport.now()
+
+    # Stop the watchdog, for example when leaving auto mode.
+    def DisarmWatchdog(self):
+        self._lastFeedTime = None
+
+    # Return statistics, in ms, on the recent intervals
+    # between runs of the command loop, or None if it hasn't
+    # run twice yet.
+    def CommandLoopJitter(self):
+        n = min(self._intervalCount, self.JITTER_HISTORY)
+        if n == 0:
+            return None
+        intervals = self._intervals[:n]*1000.0
+        p50, p99 = np.percentile(intervals, [50, 99])
+        return dict(count=n, mean=intervals.mean(),
+          std=intervals.std(), p50=p50, p99=p99,
+          max=intervals.max())
+
     # Internal function -- do not call outside this class.
     #
     # The drone needs a flight command send to it
@@ -188,20 +311,84 @@ class BasicDroneController(object):
     # continuously-running timer, which re-sends the last
     # flight command specified by ``SetCommand``.
     def _SendCommand(self, event):
+        # Record how long it's been since the last run.
+        now = self.transport.now()
+        if self._lastSendTime is not None:
+            interval = now - self._lastSendTime
+            self._intervals[self._intervalCount %
+              self.JITTER_HISTORY] = interval
+            self._intervalCount += 1
+            self._commandIntervalSeconds.observe(interval)
+        self._lastSendTime = now
+
+        # Hover if the command is stale.
+        last_feed = self._lastFeedTime
+        if (last_feed is not None and
+            now - last_feed > self.WATCHDOG_DEADLINE/1000.0):
+            self._lastFeedTime = None
+            self.hover()
+            self._watchdogTrips.inc()
+            self.transport.logwarn('No fresh command for {:.0f} ms; '
+              'hovering.'.format((now - last_feed)*1000.0))
+            for handler in self.watchdogHandlers:
+                handler(now - last_feed)
+
         # The previously set command is then sent out
         # periodically if the drone is flying.
         if (self.status == DroneStatus.Flying or
             self.status == DroneStatus.GotoHover or
             self.status == DroneStatus.Hovering):
             self.pubCommand.publish(self.command)
+            self._commandsSent.inc()
+
+    # Internal function -- do not call outside this class.
+    #
+    # Run ``_SendCommand`` every ``COMMAND_PERIOD`` on a
+    # dedicated thread. Deadlines are computed from the start
+    # time, so delays don't accumulate.
+    def _CommandLoop(self):
+        # Real-time scheduling keeps vision and GUI work from
+        # delaying commands, but requires privileges; on Linux,
+        # this applies to the calling thread only.
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO,
+              os.sched_param(10))
+        except (AttributeError, OSError):
+            self.transport.logwarn('Unable to give the command thread '
+              'real-time priority.')
+        period = self.COMMAND_PERIOD/1000.0
+        deadline = time.time()
+        while not self.transport.is_shutdown():
+            deadline += period
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Far behind schedule; don't try to catch up.
+                deadline = time.time()
+            self._SendCommand(None)
 
     # Internal function -- do not call outside this class.
     #
     # This is invoked when the drone reports its navdata.
     # Save it for later use.
     def _ReceiveNavdata(self, navdata):
+        # Charge the time since the last message to the
+        # status the drone was in.
+        now = self.transport.now()
+        if self._lastNavdataTime is not None:
+            self._statusSeconds.get(self.status,
+              self._unknownStatusSeconds).inc(
+              now - self._lastNavdataTime)
+        self._lastNavdataTime = now
+        self._navdataReceived.inc()
+
         # Although there is a lot of data in this packet,
-        # we're only interested in the state at the moment.
+        # we're only interested in the state, battery and
+        # attitude at the moment.
         self.status = navdata.state
+        self.batteryPercent = navdata.batteryPercent
+        self.navdata.add(navdata.header.stamp.to_sec(),
+          navdata.rotX, navdata.rotY)
 
 
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# .. -*- coding: utf-8 -*-
+#
+# *******************************************************************
+# find_car_batch.py - Run the color blob detector over recorded video
+# *******************************************************************
+# This program runs :func:`webcam_find_car.find_car` over every frame of video files or directories of images, using all CPU cores, then writes the center, area and processing time of the blob found in each frame to a CSV or NPZ file. Optionally, it also writes a video of the overlay which ``ButtonGui`` would display. Use it to label datasets or to check a threshold across hours of footage. For example::
+#
+#    python find_car_batch.py flight1.avi frames/ --color 1,0,0 \
+#      --threshold 0.5 --output results.csv --overlay overlay.avi
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+from __future__ import print_function
+import argparse
+import csv
+import os
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+#
+# Third-party imports
+# -------------------
+import cv2
+import numpy as np
+#
+# Local imports
+# -------------
+from webcam_find_car import find_car
+
+# Files in an image directory with these extensions are processed, in sorted order.
+IMAGE_EXTENSIONS = ('.bmp', '.jpeg', '.jpg', '.png', '.ppm', '.tif', '.tiff')
+#
+#
+# Reading frames
+# ==============
+# Yield (source, frame_index, rgb_image) for every frame in ``paths``, each of which may be a video file or a directory of images. Frames are converted to RGB, the channel order ``ButtonGui`` uses.
+def read_frames(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(name for name in os.listdir(path)
+              if name.lower().endswith(IMAGE_EXTENSIONS))
+            for index, name in enumerate(names):
+                image = cv2.imread(os.path.join(path, name))
+                if image is not None:
+                    yield path, index, cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        else:
+            capture = cv2.VideoCapture(path)
+            if not capture.isOpened():
+                raise IOError('Unable to open {}.'.format(path))
+            index = 0
+            while True:
+                ok, image = capture.read()
+                if not ok:
+                    break
+                yield path, index, cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                index += 1
+            capture.release()
+#
+#
+# Processing frames
+# =================
+# Each worker process receives the tracking parameters once, through :func:`_init_worker`, rather than with every frame.
+_params = None
+
+def _init_worker(color, thresh, scale, want_overlay):
+    global _params
+    _params = (color, thresh, scale, want_overlay)
+
+# Process one frame, returning (source, frame_index, x_center, y_center, cont_area, ms, overlay). The overlay is None unless requested.
+def process_frame(item):
+    source, index, image = item
+    color, thresh, scale, want_overlay = _params
+    start = default_timer()
+    if scale != 1.0:
+        image = cv2.resize(image, (int(round(image.shape[1]*scale)),
+          int(round(image.shape[0]*scale))))
+    view_image, cont_image, center_mass, cont_area = find_car(image, color, thresh)
+    ms = (default_timer() - start)*1000.0
+    return (source, index, center_mass[0], center_mass[1], cont_area, ms,
+      cont_image if want_overlay else None)
+
+# Like ``pool.imap(func, items)``, yielding results in order, but with at most ``max_pending`` items taken from ``items`` and not yet yielded. ``imap`` reads ahead without limit, pickling every decoded frame into its task queue long before workers reach it; over hours of footage, that exhausts memory.
+def bounded_imap(pool, func, items, max_pending):
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+#
+#
+# Writing results
+# ===============
+COLUMNS = ('source', 'frame', 'x_center', 'y_center', 'cont_area', 'ms')
+
+def write_csv(path, rows):
+    with open(path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+
+def write_npz(path, rows):
+    columns = list(zip(*rows)) if rows else [()]*len(COLUMNS)
+    np.savez(path, **dict(zip(COLUMNS, (np.array(c) for c in columns))))
+
+# Writes overlay frames to a video, opening it when the first frame arrives so its size is known.
+class OverlayWriter(object):
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self._writer = None
+
+    def write(self, rgb_image):
+        if self._writer is None:
+            self._size = (rgb_image.shape[1], rgb_image.shape[0])
+            self._writer = cv2.VideoWriter(self.path,
+              cv2.VideoWriter_fourcc(*'MJPG'), self.fps, self._size)
+        # Frames from a different source may differ in size.
+        if (rgb_image.shape[1], rgb_image.shape[0]) != self._size:
+            rgb_image = cv2.resize(rgb_image, self._size)
+        self._writer.write(cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+#
+#
+# Main
+# ====
+def parse_color(s):
+    color = np.array([float(c) for c in s.split(',')], dtype=np.float32)
+    if color.shape != (3,):
+        raise argparse.ArgumentTypeError('Expected three comma-separated values.')
+    return color
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run find_car over video files and image directories.')
+    parser.add_argument('inputs', nargs='+',
+      help='Video files or directories of images.')
+    parser.add_argument('--color', type=parse_color, default='1,0,0',
+      help='The RGB color to track, with each channel from 0 to 1 (default: %(default)s).')
+    parser.add_argument('--threshold', type=float, default=0.5,
+      help='The color threshold; the GUI slider value divided by 100 (default: %(default)s).')
+    parser.add_argument('--scale', type=float, default=0.5,
+      help='Resize frames by this factor before processing, as the GUI does (default: %(default)s).')
+    parser.add_argument('--output', default='find_car.csv',
+      help='The .csv or .npz file to write results to (default: %(default)s).')
+    parser.add_argument('--overlay',
+      help='Write the overlay images to this video file.')
+    parser.add_argument('--fps', type=float, default=30.0,
+      help='The frame rate of the overlay video (default: %(default)s).')
+    parser.add_argument('--jobs', type=int, default=cpu_count(),
+      help='The number of worker processes (default: %(default)s).')
+    args = parser.parse_args(argv)
+
+    pool = Pool(args.jobs, _init_worker,
+      (args.color, args.threshold, args.scale, bool(args.overlay)))
+    overlay = OverlayWriter(args.overlay, args.fps) if args.overlay else None
+    rows = []
+    start = default_timer()
+    try:
+        # Results arrive in frame order. A few frames per worker
+        # keep every worker busy while bounding memory use.
+        for result in bounded_imap(pool, process_frame,
+          read_frames(args.inputs), 4*args.jobs):
+            rows.append(result[:-1])
+            if overlay:
+                overlay.write(result[-1])
+    finally:
+        pool.close()
+        pool.join()
+        if overlay:
+            overlay.close()
+
+    if args.output.endswith('.npz'):
+        write_npz(args.output, rows)
+    else:
+        write_csv(args.output, rows)
+    elapsed = default_timer() - start
+    print('Processed {} frames in {:.1f} s ({:.1f} frames/s).'.format(
+      len(rows), elapsed, len(rows)/elapsed if elapsed else 0.0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# .. -*- coding: utf-8 -*-
+#
+# ***********************************************************
+# find_car_benchmark.py - Timing for the color blob detector
+# ***********************************************************
+# This program times :func:`webcam_find_car.find_car` on synthetic frames at several resolutions and thread counts, checking that each threaded result matches the serial one exactly. Run it with ``python find_car_benchmark.py``; it needs neither ROS nor a drone.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+from __future__ import print_function
+from multiprocessing import cpu_count
+from timeit import default_timer
+#
+# Third-party imports
+# -------------------
+import cv2
+import numpy as np
+#
+# Local imports
+# -------------
+from webcam_find_car import find_car, classify_pixels
+
+# Resolutions to benchmark, as (width, height): the half-size frame which ``ButtonGui`` processes by default, then the full 640x360 frame the AR.Drone 2 sends (``ButtonGui.VISION_MAX_SCALE``).
+RESOLUTIONS = [(320, 180), (640, 360)]
+# The color and threshold searched for.
+COLOR = np.array([1, 0, 0], dtype=np.float32)
+THRESH = 0.5
+
+# Create a noisy frame containing a few blobs of the target color, so that the threshold, morphology and contour steps all have real work to do.
+def synthetic_frame(width, height, seed=0):
+    rng = np.random.RandomState(seed)
+    image = rng.randint(0, 256, (height, width, 3)).astype(np.uint8)
+    for i in range(5):
+        center = (int(rng.randint(width)), int(rng.randint(height)))
+        cv2.circle(image, center, int(rng.randint(5, height//4)), (255, 0, 0), -1)
+    return image
+
+# Return the best-of-``repeat`` time, in ms, to run ``func``.
+def time_ms(func, repeat=20):
+    best = float('inf')
+    for i in range(repeat):
+        start = default_timer()
+        func()
+        best = min(best, default_timer() - start)
+    return best*1000.0
+
+def main():
+    thread_counts = sorted(set([1, 2, 4, cpu_count()]))
+    print('{:>10} {:>8} {:>10} {:>8}'.format('size', 'threads', 'ms/frame', 'speedup'))
+    for width, height in RESOLUTIONS:
+        image = synthetic_frame(width, height)
+        serial_mask = classify_pixels(image, COLOR, THRESH)[0]
+        serial_ms = None
+        for threads in thread_counts:
+            mask = classify_pixels(image, COLOR, THRESH, threads)[0]
+            assert np.array_equal(mask, serial_mask), 'Threaded mask differs from serial mask.'
+            ms = time_ms(lambda: find_car(image, COLOR, THRESH, threads))
+            serial_ms = serial_ms or ms
+            print('{:>10} {:>8} {:>10.2f} {:>8.2f}'.format('{}x{}'.format(width, height), threads, ms, serial_ms/ms))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# .. -*- coding: utf-8 -*-
+#
+# ***************************************************************
+# flight_log.py - Record each frame's flight decision to disk
+# ***************************************************************
+# To debug an autonomous flight after the fact, this module records, for every video frame, the tracking result, the state of ``fly``, the command handed to ``SetCommand``, and the drone's status. Each frame becomes one fixed-width binary record, so the log is compact, cheap to write, and loads directly into NumPy arrays.
+#
+# Writing never blocks the vision and control code: :meth:`FlightLogger.log` only appends a tuple to a ``collections.deque``, whose ``append`` and ``popleft`` are atomic, so no lock is needed. A background thread drains this queue to disk in batches, starting a new file when the current one grows too large.
+#
+# Logging must never take down a flight, nor quietly eat memory. Records which don't fit :data:`RECORD_DTYPE` (a ``fly_state`` which isn't an integer, for example) are dropped and counted. If writing fails, the error is reported once on stderr, and later records are discarded.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+import os
+import struct
+import sys
+import threading
+from collections import deque
+#
+# Third-party imports
+# -------------------
+import numpy as np
+#
+#
+# File format
+# ===========
+# Each file begins with a header: this magic string, then the record size as a little-endian 32-bit unsigned integer. Fixed-width records follow.
+MAGIC = b'MAVFLOG1'
+HEADER = struct.Struct('<8sI')
+# The contents of one record.
+RECORD_DTYPE = np.dtype([
+  # The time at which the frame was processed, in seconds since the epoch.
+  ('time', '<f8'),
+  # The tracking result passed to ``fly``; see ``ButtonGui.videoFrame``.
+  ('x_center', '<f4'),
+  ('y_center', '<f4'),
+  ('cont_area', '<f4'),
+  # The state of ``fly`` (``MavControl.state``), or -1 when not in auto mode.
+  ('fly_state', '<i4'),
+  # The command last given to ``BasicDroneController.SetCommand``.
+  ('roll', '<f4'),
+  ('pitch', '<f4'),
+  ('yaw_velocity', '<f4'),
+  ('z_velocity', '<f4'),
+  # The drone's status, a ``DroneStatus`` value.
+  ('drone_status', '<i4'),
+])
+#
+#
+# FlightLogger
+# ============
+class FlightLogger(object):
+    def __init__(self,
+      # The file to log to. Full files are renamed to ``path.1``, ``path.2``, etc. as in ``logging.handlers.RotatingFileHandler``. A log left by a previous run is rotated the same way, so each run starts a new file without erasing the last flight.
+      path,
+      # Start a new file once the current one reaches this size.
+      max_bytes=64*1024*1024,
+      # The number of full files to keep.
+      backup_count=5,
+      # How often, in seconds, the background thread writes queued records.
+      flush_interval=0.25,
+      # The most records to queue; if the writer falls this far behind, the oldest are lost.
+      max_queue=100000):
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self._queue = deque(maxlen=max_queue)
+        # The number of records dropped because they didn't fit ``RECORD_DTYPE``.
+        self.dropped = 0
+        # The exception which stopped writing, or None.
+        self.error = None
+        self._stop = threading.Event()
+        self._file = None
+        if os.path.exists(path) and os.path.getsize(path) > HEADER.size:
+            self._shift_backups()
+        self._open()
+        self._thread = threading.Thread(target=self._write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # Queue one record. This is safe to call from any thread and never waits on the disk.
+    def log(self, time, center_mass, cont_area, fly_state, command,
+      drone_status):
+
+        if self.error:
+            return
+        self._queue.append((time, center_mass[0], center_mass[1],
+          cont_area, fly_state, command.linear.y, command.linear.x,
+          command.angular.z, command.linear.z, drone_status))
+
+    # Write any queued records, then close the log.
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        if not self._file.closed:
+            self._file.close()
+
+    def _write_loop(self):
+        try:
+            while not self._stop.wait(self.flush_interval):
+                self._flush()
+            self._flush()
+        except Exception as e:
+            self.error = e
+            self._queue.clear()
+            sys.stderr.write('Flight log {} stopped: {}\n'.format(self.path, e))
+
+    # Write all queued records as one batch.
+    def _flush(self):
+        records = []
+        try:
+            while True:
+                records.append(self._queue.popleft())
+        except IndexError:
+            pass
+        if not records:
+            return
+        try:
+            data = np.array(records, dtype=RECORD_DTYPE)
+        except (TypeError, ValueError):
+            # Keep the records which fit.
+            good = []
+            for record in records:
+                try:
+                    good.append(np.array(record, dtype=RECORD_DTYPE))
+                except (TypeError, ValueError):
+                    self.dropped += 1
+            data = np.array(good, dtype=RECORD_DTYPE)
+        self._file.write(data.tobytes())
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._file = open(self.path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, RECORD_DTYPE.itemsize))
+
+    # Close the current file and start a new one.
+    def _rotate(self):
+        self._file.close()
+        self._shift_backups()
+        self._open()
+
+    # Shift ``path.n`` to ``path.n+1``, discarding the oldest, then move ``path`` to ``path.1``.
+    def _shift_backups(self):
+        for n in range(self.backup_count - 1, 0, -1):
+            src = '{}.{}'.format(self.path, n)
+            if os.path.exists(src):
+                os.rename(src, '{}.{}'.format(self.path, n + 1))
+        if self.backup_count > 0:
+            os.rename(self.path, self.path + '.1')
+#
+#
+# Reading logs
+# ============
+# Load a log file, returning a dict which maps each field name in :data:`RECORD_DTYPE` to a NumPy array holding that field for every record.
+def load_flight_log(path):
+    with open(path, 'rb') as f:
+        magic, record_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or record_size != RECORD_DTYPE.itemsize:
+            raise ValueError('{} is not a flight log.'.format(path))
+        records = np.fromfile(f, dtype=RECORD_DTYPE)
+    return dict((name, records[name]) for name in RECORD_DTYPE.names)
@@ -0,0 +1,128 @@
+# .. -*- coding: utf-8 -*-
+#
+# ****************************************************************
+# flow_tracker.py - Track a color blob with sparse optical flow
+# ****************************************************************
+# Once the target is found, there's no need to run the whole color, threshold, morphology and contour pipeline of :func:`webcam_find_car.find_car` on every frame. This module's :class:`FlowTracker` runs a full detection every few frames (or whenever asked). In between, it follows a few feature points inside the detected blob using pyramidal `Lucas-Kanade optical flow <http://docs.opencv.org/modules/video/doc/motion_analysis_and_object_tracking.html#calcopticalflowpyrlk>`_, moving the blob by the points' median motion. Tracking a few dozen points costs a small fraction of a full detection.
+#
+# Flow is checked for consistency each frame: each point is tracked forward then back, and must return near where it started; the surviving points must also move together. If too few points pass, the tracker falls back to a full detection.
+#
+# Imports
+# =======
+# Third-party imports
+# -------------------
+import cv2
+import numpy as np
+#
+# Local imports
+# -------------
+from webcam_find_car import classify_pixels, find_contours, draw_car_contour
+#
+#
+# FlowTracker
+# ===========
+class FlowTracker(object):
+    # Parameters for `goodFeaturesToTrack <http://docs.opencv.org/modules/imgproc/doc/feature_detection.html#goodfeaturestotrack>`_ and calcOpticalFlowPyrLK.
+    FEATURE_PARAMS = dict(qualityLevel=0.01, minDistance=5, blockSize=5)
+    FLOW_PARAMS = dict(winSize=(15, 15), maxLevel=2,
+      criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+    def __init__(self,
+      # Run a full detection at least once every this many frames.
+      detect_interval=10,
+      # The number of feature points to track within the blob.
+      max_points=30,
+      # Fall back to a full detection if fewer points than this survive the consistency checks.
+      min_points=5,
+      # The largest allowed distance, in pixels, between a point's start and its position after tracking forward then back.
+      max_fb_error=1.0,
+      # The largest allowed median distance, in pixels, between a point's motion and the median motion of all points.
+      max_spread=2.0):
+
+        self.detect_interval = detect_interval
+        self.max_points = max_points
+        self.min_points = min_points
+        self.max_fb_error = max_fb_error
+        self.max_spread = max_spread
+        # The number of full detections and flow-only frames so far.
+        self.detections = 0
+        self.flow_frames = 0
+        self.reset()
+
+    # Force a full detection on the next frame; call this when the tracking color, threshold, or image scale changes.
+    def reset(self):
+        # The previous grayscale frame, the points tracked in it, the contour of the blob when last detected, and the blob's motion since then. The motion is kept in floating point, so shifts of less than a pixel per frame accumulate.
+        self._gray = None
+        self._points = None
+        self._contour = None
+        self._offset = np.zeros(2)
+        self._frames_since_detect = 0
+
+    # Find the blob in ``image``, returning the same (view_image, cont_image, mass_center, cont_area) as :func:`webcam_find_car.find_car`. Requesting a ``debug_view`` other than the overlay forces a full detection, since flow-only frames produce no intermediates.
+    def track(self, image, lab_color, thresh, threads=1, force=False,
+      debug_view=None):
+
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        force = force or debug_view not in (None, 'overlay')
+        if (not force and self._points is not None and
+            self._frames_since_detect < self.detect_interval):
+            result = self._flow(image, gray)
+            if result is not None:
+                self.flow_frames += 1
+                self._frames_since_detect += 1
+                return result
+        return self._detect(image, gray, lab_color, thresh, threads,
+          debug_view)
+
+    # Run a full detection, then pick points to track inside the blob found.
+    def _detect(self, image, gray, lab_color, thresh, threads, debug_view):
+        self.detections += 1
+        self._frames_since_detect = 0
+        open_image, view_image = classify_pixels(image, lab_color, thresh,
+          threads, debug_view)
+        if debug_view == 'opened':
+            view_image = open_image
+        contours = find_contours(open_image)
+        cont_image, mass_center, cont_area = draw_car_contour(image, contours)
+
+        self._gray = gray
+        self._points = None
+        self._offset = np.zeros(2)
+        if contours:
+            self._contour = max(contours, key=cv2.contourArea)
+            mask = np.zeros(gray.shape, np.uint8)
+            cv2.drawContours(mask, [self._contour], 0, 255, -1)
+            points = cv2.goodFeaturesToTrack(gray, self.max_points,
+              mask=mask, **self.FEATURE_PARAMS)
+            if points is not None and len(points) >= self.min_points:
+                self._points = points
+        return view_image, cont_image, mass_center, cont_area
+
+    # Move the blob by the flow of its points, or return None if the flow isn't trustworthy.
+    def _flow(self, image, gray):
+        forward, status, err = cv2.calcOpticalFlowPyrLK(self._gray, gray,
+          self._points, None, **self.FLOW_PARAMS)
+        back, back_status, err = cv2.calcOpticalFlowPyrLK(gray, self._gray,
+          forward, None, **self.FLOW_PARAMS)
+        fb_error = np.abs(self._points - back).reshape(-1, 2).max(-1)
+        good = ((status.ravel() == 1) & (back_status.ravel() == 1) &
+                (fb_error < self.max_fb_error))
+        if good.sum() < self.min_points:
+            return None
+
+        motion = (forward - self._points).reshape(-1, 2)[good]
+        shift = np.median(motion, 0)
+        if np.median(np.abs(motion - shift).max(-1)) > self.max_spread:
+            return None
+
+        self._gray = gray
+        self._points = forward[good].reshape(-1, 1, 2)
+        self._offset += shift
+        # Draw the contour at the nearest pixel, then restore the fraction of a pixel lost to rounding in its center.
+        rounded = np.round(self._offset)
+        cont_image, mass_center, cont_area = draw_car_contour(image,
+          [self._contour + rounded.astype(self._contour.dtype)])
+        if mass_center != (-1, -1):
+            mass_center = (mass_center[0] + self._offset[0] - rounded[0],
+              mass_center[1] + self._offset[1] - rounded[1])
+        return None, cont_image, mass_center, cont_area
@@ -0,0 +1,175 @@
+# .. -*- coding: utf-8 -*-
+#
+# ********************************************************************
+# frame_bus.py - Run the vision pipeline in a separate process
+# ********************************************************************
+# Qt painting, ROS callbacks and the NumPy/OpenCV work of :func:`webcam_find_car.find_car` all compete for the same interpreter; contention for the GIL shows up as jittery frame times. :class:`VisionProcess` moves ``find_car`` to its own process, which holds its own GIL.
+#
+# Frames pass through a ring of slots in shared memory, not through a pipe: the GUI copies a frame into a free slot and sends only the slot's index and the tracking parameters. The vision process draws its overlay back into the same slot, then returns the index with the (small) tracking result. No frame is ever pickled.
+#
+# If frames arrive faster than the vision process can handle them, it processes only the latest, returning the others unprocessed.
+#
+# ``fly`` stays in the GUI process: it updates widgets and sends commands through the GUI's ``BasicDroneController``, and its cost is trivial next to ``find_car``.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+import ctypes
+import multiprocessing
+import time
+from multiprocessing.sharedctypes import RawArray
+# The queue module was renamed in Python 3.
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+#
+# Third-party imports
+# -------------------
+import numpy as np
+#
+# Local imports
+# -------------
+from webcam_find_car import find_car, debug_view_to_rgb
+from flow_tracker import FlowTracker
+#
+#
+# FrameRing
+# =========
+# A fixed number of 8-bit image slots in shared memory, each holding an image of at most ``max_shape``. Created before forking, it's shared by both processes.
+class FrameRing(object):
+    def __init__(self, slots, max_shape):
+        self.slots = slots
+        self.slot_size = int(np.prod(max_shape))
+        self._buffer = RawArray(ctypes.c_uint8, slots*self.slot_size)
+
+    # True if an image of ``shape`` fits in a slot.
+    def fits(self, shape):
+        return int(np.prod(shape)) <= self.slot_size
+
+    # Return the image in ``slot`` as a NumPy array of the given shape. This is a view of shared memory, not a copy.
+    def view(self, slot, shape):
+        if not self.fits(shape):
+            raise ValueError('An image of shape {} exceeds the slot size.'.format(shape))
+        offset = slot*self.slot_size
+        return np.frombuffer(self._buffer, np.uint8, int(np.prod(shape)),
+          offset).reshape(shape)
+#
+#
+# VisionProcess
+# =============
+class VisionProcess(object):
+    def __init__(self,
+      # The largest frame, as a NumPy shape, which will be submitted. The AR.Drone 2's front camera sends 640x360 frames; ``ButtonGui`` scales this by its largest processing scale.
+      max_shape=(360, 640, 3),
+      # The number of threads used to classify pixels; see ``webcam_find_car.classify_pixels``.
+      threads=1,
+      # If greater than 1, follow the blob with optical flow between full detections; see ``flow_tracker``.
+      flow_interval=1,
+      # The number of slots. With two, the GUI can fill one while the vision process works on the other.
+      slots=2):
+
+        self.ring = FrameRing(slots, max_shape)
+        # Slots the GUI may fill, and the shape, timestamp and processing scale of each slot in use. Only the GUI process touches these.
+        self._free = list(range(slots))
+        self._inUse = {}
+        # True if a reset was requested but its frame couldn't be submitted; the next submitted frame carries it.
+        self._resetPending = False
+        self._requests = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_vision_main,
+          args=(self.ring, self._requests, self._results, threads,
+          flow_interval))
+        self._process.daemon = True
+        self._process.start()
+
+    # Copy ``image`` into a free slot and queue it for ``find_car`` with the given parameters. ``stamp`` (the frame's time) and ``scale`` are returned with the result. ``flow`` allows optical flow tracking; ``reset`` restarts it (after a change in parameters, for example). Return False if every slot is busy, dropping the frame; a reset is then kept for the next frame submitted. Raise ``ValueError`` if ``image`` is larger than a slot.
+    def submit(self, image, stamp, scale, thresh, lab_color, debug_view=None,
+      flow=True, reset=False):
+
+        if not self.ring.fits(image.shape):
+            raise ValueError('An image of shape {} exceeds the slot size.'.format(
+              image.shape))
+        reset = reset or self._resetPending
+        if not self._free:
+            self._resetPending = reset
+            return False
+        self._resetPending = False
+        slot = self._free.pop()
+        self.ring.view(slot, image.shape)[...] = image
+        self._inUse[slot] = (image.shape, stamp, scale)
+        self._requests.put((slot, image.shape, thresh, lab_color, debug_view,
+          flow, reset))
+        return True
+
+    # True while the vision process is running.
+    @property
+    def alive(self):
+        return self._process.is_alive()
+
+    # True if a submitted frame hasn't yet been returned by ``poll``.
+    @property
+    def pending(self):
+        return bool(self._inUse)
+
+    # Return the newest result received since the last call, or None if there is none. A result is a tuple of (overlay, mass_center, cont_area, proc_time, stamp, scale): ``overlay`` is a private copy of the image to display (the requested debug view, or the outlined blob) at the processing scale, ``proc_time`` the time in seconds the vision process took, and ``stamp`` and ``scale`` those passed to ``submit``. Raise ``RuntimeError`` if the vision process has exited, since no result will ever come.
+    def poll(self):
+        if not self.alive:
+            raise RuntimeError('The vision process exited with code {}.'.format(
+              self._process.exitcode))
+        latest = None
+        while True:
+            try:
+                slot, result = self._results.get_nowait()
+            except Empty:
+                break
+            shape, stamp, scale = self._inUse.pop(slot)
+            if result is not None:
+                mass_center, cont_area, proc_time = result
+                latest = (self.ring.view(slot, shape).copy(), mass_center,
+                  cont_area, proc_time, stamp, scale)
+            self._free.append(slot)
+        return latest
+
+    # Stop the vision process.
+    def stop(self, timeout=1.0):
+        self._requests.put(None)
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+
+# The vision process's main loop.
+def _vision_main(ring, requests, results, threads, flow_interval):
+    tracker = FlowTracker(flow_interval) if flow_interval > 1 else None
+    while True:
+        request = requests.get()
+        # Skip to the latest request, returning older slots unprocessed. A reset requested by any skipped request still applies.
+        while request is not None:
+            try:
+                newer = requests.get_nowait()
+            except Empty:
+                break
+            results.put((request[0], None))
+            if newer is not None and request[-1]:
+                newer = newer[:-1] + (True,)
+            request = newer
+        if request is None:
+            return
+
+        start = time.time()
+        slot, shape, thresh, lab_color, debug_view, flow, reset = request
+        image = ring.view(slot, shape)
+        if tracker and reset:
+            tracker.reset()
+        if tracker and flow:
+            view_image, cont_image, mass_center, cont_area = tracker.track(
+              image, lab_color, thresh, threads, debug_view=debug_view)
+        else:
+            view_image, cont_image, mass_center, cont_area = find_car(
+              image, lab_color, thresh, threads, debug_view)
+        # Return the image to display in the frame's own slot.
+        if view_image is not None:
+            cont_image = debug_view_to_rgb(view_image)
+        image[...] = cont_image
+        results.put((slot, (mass_center, cont_area, time.time() - start)))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# .. -*- coding: utf-8 -*-
+#
+# ****************************************************************
+# gain_search.py - Search for controller gains using flight logs
+# ****************************************************************
+# Tuning ``fly`` by trial and error means flight after flight. This program instead replays the target tracks recorded by :class:`flight_log.FlightLogger` against a simple model of the drone, evaluating thousands of candidate gain sets at once, then reports the best. For example::
+#
+#    python gain_search.py ~/.ros/mav_flight.log --output gains.json
+#
+# The controller
+# ==============
+# Each axis uses a proportional-derivative controller with a deadband on a normalized error ``e``, where 0 means the target is where it should be:
+#
+# ========  ==========================================  ==========================
+# Axis      Error                                       Command
+# ========  ==========================================  ==========================
+# ``ROLL``  ``(x_center - width/2)/(width/2)``          ``roll = -u``
+# ``Z``     ``(y_center - height/2)/(height/2)``        ``z_velocity = -u``
+# ``PITCH`` ``1 - sqrt(cont_area/target_area)``         ``pitch = u``
+# ========  ==========================================  ==========================
+#
+# Here, ``u = clip(KP*e + KD*de/dt, -1, 1)``, or 0 while ``abs(e) < DEADBAND``. The exported gains give ``KP``, ``KD`` and ``DEADBAND`` for each axis as class constants (``ROLL_KP``, ``Z_KD``, and so on) for use in ``MavControl.fly``.
+#
+# The model
+# =========
+# The recorded track is treated as the motion of the target as seen from a drone holding still, so logs recorded while hovering under manual control suit it best. The simulated drone's velocity, in normalized error units per second, follows ``RATE*u`` with a first-order lag of time constant ``TAU``; its position is subtracted from the target's. The model is crude: it ignores coupling between axes and the drone's own attitude. Check the gains it picks in a real flight before trusting them.
+#
+# Each candidate is scored on:
+#
+# - Settling time: the total time during which ``abs(e)`` is at least ``band``. For a single step, this is the usual settling time; a moving target adds the time taken to catch up after each move.
+# - Overshoot: the largest error on the far side of zero, in units of ``band``. The track is split into segments wherever the target has moved by more than ``band`` since the segment began; within each segment, the far side is the side opposite the error at the segment's start.
+# - Effort: the mean absolute command.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+from __future__ import print_function, division
+import argparse
+import json
+#
+# Third-party imports
+# -------------------
+import numpy as np
+#
+# Local imports
+# -------------
+from flight_log import load_flight_log
+#
+#
+# Tracks
+# ======
+AXES = ('ROLL', 'Z', 'PITCH')
+
+# Return (times, errors) from the flight log at ``path``, where ``errors`` is a dict mapping each of ``AXES`` to its normalized error per frame. Frames without a detection repeat the last detected error; those before the first detection are dropped. ``target_area`` defaults to the median detected area.
+def load_tracks(path, width, height, target_area=None):
+    log = load_flight_log(path)
+    found = log['x_center'] >= 0
+    if not found.any():
+        raise ValueError('{} contains no detections.'.format(path))
+    # Forward-fill frames without a detection.
+    last = np.maximum.accumulate(np.where(found, np.arange(found.size), 0))
+    first = np.argmax(found)
+    index = last[first:]
+    area = log['cont_area'][index].astype(np.float64)
+    if target_area is None:
+        target_area = np.median(log['cont_area'][found])
+    errors = {
+      'ROLL': (log['x_center'][index] - width/2.0)/(width/2.0),
+      'Z': (log['y_center'][index] - height/2.0)/(height/2.0),
+      'PITCH': 1.0 - np.sqrt(area/target_area),
+    }
+    return log['time'][first:], dict((axis, e.astype(np.float64))
+      for axis, e in errors.items())
+#
+#
+# Simulation
+# ==========
+# Simulate every candidate following ``target`` (the error per frame, at ``times``), returning arrays of settling time, overshoot and effort, one entry per candidate. ``candidates`` is an N by 3 array whose rows are (KP, KD, DEADBAND); all N are simulated together, one frame at a time.
+def simulate(times, target, candidates, tau=0.3, rate=1.0, band=0.1):
+    kp, kd, deadband = (candidates[:, i] for i in range(3))
+    n = candidates.shape[0]
+    position = np.zeros(n)
+    velocity = np.zeros(n)
+    error = np.full(n, target[0])
+    effort = np.zeros(n)
+    # The time each candidate's error has spent outside the band.
+    unsettled = np.zeros(n)
+    # The target position at the start of the current segment, and the sign of each candidate's error then.
+    segment_target = target[0]
+    approach = np.full(n, np.sign(target[0]))
+    far_side = np.zeros(n)
+    for i in range(1, len(times)):
+        dt = times[i] - times[i - 1]
+        if dt <= 0:
+            continue
+        new_error = target[i] - position
+        if abs(target[i] - segment_target) > band:
+            segment_target = target[i]
+            approach = np.sign(new_error)
+        u = np.clip(kp*new_error + kd*(new_error - error)/dt, -1.0, 1.0)
+        u[np.abs(new_error) < deadband] = 0.0
+        error = new_error
+        # Apply the command to the first-order model.
+        velocity += (rate*u - velocity)*min(dt/tau, 1.0)
+        position += velocity*dt
+
+        effort += np.abs(u)*dt
+        unsettled[np.abs(error) >= band] += dt
+        np.maximum(far_side, -approach*error, out=far_side)
+
+    duration = times[-1] - times[0]
+    return unsettled, far_side/band, effort/duration if duration else effort
+
+# Return an N by 3 array of candidates: every combination of the given KP, KD and DEADBAND values.
+def candidate_grid(kp, kd, deadband):
+    return np.array(np.meshgrid(kp, kd, deadband, indexing='ij')).reshape(3, -1).T
+#
+#
+# Main
+# ====
+def parse_range(s):
+    start, stop, count = s.split(',')
+    return np.linspace(float(start), float(stop), int(count))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Search for fly gains using recorded flight logs.')
+    parser.add_argument('logs', nargs='+',
+      help='Flight logs written by flight_log.FlightLogger.')
+    parser.add_argument('--width', type=float, default=320,
+      help='The width of the displayed video, in pixels (default: %(default)s).')
+    parser.add_argument('--height', type=float, default=180,
+      help='The height of the displayed video, in pixels (default: %(default)s).')
+    parser.add_argument('--target-area', type=float,
+      help='The blob area to hold, in pixels (default: the median area in each log).')
+    parser.add_argument('--kp', type=parse_range, default='0.1,3,40',
+      help='KP values to try, as start,stop,count (default: %(default)s).')
+    parser.add_argument('--kd', type=parse_range, default='0,1,25',
+      help='KD values to try, as start,stop,count (default: %(default)s).')
+    parser.add_argument('--deadband', type=parse_range, default='0,0.2,5',
+      help='DEADBAND values to try, as start,stop,count (default: %(default)s).')
+    parser.add_argument('--tau', type=float, default=0.3,
+      help='The time constant of the drone model, in seconds (default: %(default)s).')
+    parser.add_argument('--rate', type=float, default=1.0,
+      help='The speed of the drone model at full command, in normalized error units per second (default: %(default)s).')
+    parser.add_argument('--band', type=float, default=0.1,
+      help='The error within which an axis counts as settled (default: %(default)s).')
+    parser.add_argument('--overshoot-weight', type=float, default=2.0,
+      help='Seconds of settling time one band of overshoot costs (default: %(default)s).')
+    parser.add_argument('--effort-weight', type=float, default=1.0,
+      help='Seconds of settling time one unit of effort costs (default: %(default)s).')
+    parser.add_argument('--top', type=int, default=5,
+      help='The number of candidates to report per axis (default: %(default)s).')
+    parser.add_argument('--output',
+      help='Write the best gains to this JSON file.')
+    args = parser.parse_args(argv)
+
+    candidates = candidate_grid(args.kp, args.kd, args.deadband)
+    tracks = [load_tracks(path, args.width, args.height, args.target_area)
+      for path in args.logs]
+    best = {}
+    for axis in AXES:
+        # Average each metric over all logs.
+        metrics = np.zeros((3, len(candidates)))
+        for times, errors in tracks:
+            metrics += simulate(times, errors[axis], candidates, args.tau,
+              args.rate, args.band)
+        settling, overshoot, effort = metrics/len(tracks)
+        score = (settling + args.overshoot_weight*overshoot +
+          args.effort_weight*effort)
+        order = np.argsort(score)
+
+        print('{} ({} candidates):'.format(axis, len(candidates)))
+        print('      KP      KD  DEADBAND  settling  overshoot  effort')
+        for i in order[:args.top]:
+            print('{:8.3f}{:8.3f}{:10.3f}{:10.2f}{:11.2f}{:8.2f}'.format(
+              candidates[i, 0], candidates[i, 1], candidates[i, 2],
+              settling[i], overshoot[i], effort[i]))
+        kp, kd, deadband = candidates[order[0]]
+        best.update({axis + '_KP': kp, axis + '_KD': kd,
+          axis + '_DEADBAND': deadband})
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict((name, float(value))
+              for name, value in best.items()), f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
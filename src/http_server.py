@@ -0,0 +1,26 @@
+# .. -*- coding: utf-8 -*-
+#
+# ***************************************************************
+# http_server.py - A threaded HTTP server for background services
+# ***************************************************************
+# ``mjpeg_server`` and ``metrics`` both serve HTTP from a background thread. This module provides what they share: the HTTP server classes, under the same names in Python 2 and 3, and a server which handles each request on its own thread.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+# The HTTP server modules were renamed in Python 3.
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+#
+#
+# ThreadingHTTPServer
+# ===================
+# Serve each client on its own thread, so a slow client (an MJPEG stream viewer, for example) doesn't block other requests. Request threads don't keep the program running, and the port may be reused immediately after a restart.
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
@@ -12,7 +12,10 @@
 # Library imports
 # ---------------
 import sys
-from os.path import dirname, join
+import threading
+import time
+from os.path import dirname, join, expanduser
+from multiprocessing import cpu_count
 #
 # Third-party imports
 # -------------------
@@ -22,7 +25,6 @@ import sip
 sip.setapi('QString', 2)
 sip.setapi('QVariant', 2)
 
-import rospy
 import cv2
 #from std_msgs.msg import String
 
@@ -33,6 +35,7 @@ from PyQt4 import uic
 from geometry_msgs.msg import Twist  	 # for sending commands to the drone
 
 from sensor_msgs.msg import Image    	 # for receiving the video feed
+from sensor_msgs.msg import CompressedImage  # for the compressed video feed
 
 from cv_bridge import CvBridge  # CvBridgeError
 
@@ -40,86 +43,571 @@ import numpy as np
 
 # Local imports
 # -------------
-from webcam_find_car import find_car
+from webcam_find_car import find_car, DEBUG_VIEWS, debug_view_to_rgb, \
+  color_distance_map, find_car_from_distance
+from motion_gate import MotionGate
+from flow_tracker import FlowTracker
+from mjpeg_server import OverlayStreamServer
+from resolution_governor import ResolutionGovernor
+from flight_log import FlightLogger
+from metrics import REGISTRY, MetricsServer, register_process_metrics
 from drone_controller import BasicDroneController
+from transport import RospyTransport
+from attitude_sync import level_position
+from power_governor import PowerGovernor
+from camera_model import camera_model
+from frame_bus import VisionProcess
 
 # Some Constants
 COMMAND_PERIOD = 100 #ms
 
 # Gui Controller
 class ButtonGui(QDialog):
-    def __init__(self):
+    # The number of threads used to classify each frame's
+    # pixels; see ``webcam_find_car.classify_pixels``.
+    VISION_THREADS = cpu_count()
+    # Frames whose thumbnail differs from the last processed
+    # frame by less than this in every cell (in 8-bit
+    # intensity levels) reuse the previous result; see
+    # ``motion_gate.MotionGate``.
+    MOTION_THRESHOLD = 10.0
+    # Process a frame after at most this many skipped frames,
+    # regardless of motion.
+    MOTION_MAX_SKIP = 10
+    # Run a full color detection once every this many
+    # processed frames, following the blob with optical flow
+    # in between (see ``flow_tracker``). Use 1 to run a full
+    # detection on every frame.
+    FLOW_DETECT_INTERVAL = 1
+    # The port on which to serve the tracking overlay as an
+    # MJPEG stream (see ``mjpeg_server``), or None to disable
+    # the stream.
+    MJPEG_PORT = None
+    # The scale, relative to the incoming video, at which video
+    # is displayed. Centers and areas passed to ``fly`` are
+    # always in this coordinate frame, whatever scale the
+    # vision pipeline actually processed.
+    DISPLAY_SCALE = 0.5
+    # The range of scales over which the resolution governor
+    # may vary processing; see ``resolution_governor``.
+    VISION_MIN_SCALE = 0.25
+    VISION_MAX_SCALE = 1.0
+    # The file recording each frame's flight decision (see
+    # ``flight_log``), or None to disable logging.
+    FLIGHT_LOG_PATH = join(expanduser('~'), '.ros', 'mav_flight.log')
+    # The local port on which to serve process metrics (see
+    # ``metrics``), or None to disable the endpoint.
+    METRICS_PORT = None
+    # True to receive JPEG-compressed video, decoding it to
+    # ``VIDEO_DECODE_SCALE`` of full size (0.5 or 0.25; 1.0 for
+    # full size); False to receive raw video. See ``RosVideo``.
+    VIDEO_COMPRESSED = False
+    VIDEO_DECODE_SCALE = 0.5
+    # True to correct the center passed to ``fly`` for the
+    # drone's roll and pitch when the frame was taken, using
+    # navdata no more than ``ATTITUDE_MAX_AGE`` seconds from
+    # the frame's timestamp. See ``attitude_sync``. Off until
+    # the sign conventions below are checked on the drone.
+    ATTITUDE_COMPENSATION = False
+    ATTITUDE_MAX_AGE = 0.05
+    # The signs which convert navdata ``rotX`` and ``rotY``
+    # into roll (positive banking right) and pitch (positive
+    # nose up) for ``attitude_sync.level_position``. If
+    # ardrone_autonomy follows REP 103, positive ``rotY`` is
+    # nose down, so ``CAMERA_PITCH_SIGN`` should be -1.
+    CAMERA_ROLL_SIGN = 1
+    CAMERA_PITCH_SIGN = 1
+    # The horizontal field of view of the front camera, in
+    # degrees (approximately; the AR.Drone 2 specifies a 92
+    # degree diagonal field of view for its 16:9 image).
+    CAMERA_FOV_X = 80.0
+    # True to run ``find_car`` in a separate process, passing
+    # frames through shared memory (see ``frame_bus``), so
+    # that it doesn't compete with Qt and ROS for the GIL.
+    # Results then arrive a frame or so later.
+    VISION_PROCESS = False
+    # The size of the frames the drone sends; the vision
+    # process's shared memory holds frames of this size at
+    # the largest processing scale.
+    VIDEO_FRAME_SIZE = (640, 360)
+    # True to display video with the lens distortion removed
+    # (which requires a calibration file; see
+    # ``camera_model``). The center passed to ``fly`` is
+    # corrected regardless.
+    UNDISTORT_DISPLAY = False
+
+    def __init__(self,
+      # The ``transport`` used to talk to the drone; by
+      # default, ROS.
+      transport=None):
+
         # Always do Qt init first.
         QDialog.__init__(self)
 
-        self.controller = BasicDroneController()
+        self.controller = BasicDroneController(transport)
 
         # Set up the user interface from Designer.
 
         uic.loadUi(join(dirname(__file__), 'mav_control.ui'), self)
         self.setWindowTitle('AR.Drone Video Feed')
-        self.cv = CvBridge()
 
         self.trackingColor = np.array([1, 0, 0], dtype=np.float32)
+        # The latest frame, at the processing scale.
+        self.cv_image = None
+        # The size of the displayed video.
+        self._displaySize = None
+        # The distance map of the frozen frame; see
+        # ``on_cbFreeze_toggled``.
+        self._frozenDistance = None
+
+        # Skip ``find_car`` on frames which are nearly identical
+        # to the last processed frame. Its ``skipped`` and
+        # ``processed`` counters show the savings.
+        self.motionGate = MotionGate(self.MOTION_THRESHOLD,
+          self.MOTION_MAX_SKIP)
+        # The tracking parameters and ``find_car`` result for the
+        # last processed frame.
+        self._findCarParams = None
+        self._findCarResult = None
+        # Reduce processing when the drone isn't flying or
+        # batteries or CPU are running low.
+        self.powerGovernor = PowerGovernor(
+          self.controller.transport.loginfo)
+
+        # Track the blob with optical flow between detections.
+        self.flowTracker = None
+        self.visionProcess = None
+        if not self.VISION_PROCESS and self.FLOW_DETECT_INTERVAL > 1:
+            self.flowTracker = FlowTracker(self.FLOW_DETECT_INTERVAL)
+        # The timestamp and processing scale of the frame which
+        # produced ``_findCarResult``.
+        self._findCarStamp = None
+        self._findCarScale = None
+        # The timestamp of the newest frame ``_findCarResult``
+        # is known to describe. ``fly`` isn't given results
+        # older than the controller's watchdog deadline.
+        self._resultStamp = None
+
+        # Choose the processing scale based on CPU load.
+        # Compressed video arrives at ``VIDEO_DECODE_SCALE``,
+        # which frames are never enlarged beyond, so the
+        # governor mustn't count on larger scales.
+        max_scale = self.VISION_MAX_SCALE
+        if self.VIDEO_COMPRESSED:
+            max_scale = min(max_scale, self.VIDEO_DECODE_SCALE)
+        self.resolutionGovernor = ResolutionGovernor(
+          min(self.VISION_MIN_SCALE, max_scale), max_scale,
+          self.DISPLAY_SCALE)
+        if self.VISION_PROCESS:
+            width, height = self.VIDEO_FRAME_SIZE
+            self.visionProcess = VisionProcess(
+              (int(round(height*max_scale)), int(round(width*max_scale)), 3),
+              self.VISION_THREADS, self.FLOW_DETECT_INTERVAL)
+        # The ratio of display to processing scale for the
+        # current frame.
+        self.videoRatio = 1.0
+        # The timestamp of the previous frame, in seconds.
+        self._lastStamp = None
+
+        # Optionally stream the overlay to remote ground stations.
+        self.overlayStream = None
+        if self.MJPEG_PORT is not None:
+            self.overlayStream = OverlayStreamServer(self.MJPEG_PORT)
+
+        # Record every frame's tracking result and command.
+        self.flightLog = None
+        if self.FLIGHT_LOG_PATH is not None:
+            self.flightLog = FlightLogger(self.FLIGHT_LOG_PATH)
+
+        # Count frames and time their processing; see ``metrics``.
+        self._framesProcessed = REGISTRY.counter(
+          'vision_frames_processed_total',
+          'Frames run through find_car.')
+        self._framesSkipped = REGISTRY.counter(
+          'vision_frames_skipped_total',
+          'Frames which reused the previous find_car result.')
+        self._framesThrottled = REGISTRY.counter(
+          'vision_frames_throttled_total',
+          'Frames skipped to hold the rate of the power mode.')
+        self._framesDropped = REGISTRY.counter(
+          'vision_frames_dropped_total',
+          'Frames published by the driver but never displayed.')
+        self._frameSeconds = REGISTRY.histogram(
+          'vision_frame_seconds', 'Time to process one frame.')
+        # The sequence number of the previous frame.
+        self._lastSeq = None
+        self.metricsServer = None
+        if self.METRICS_PORT is not None:
+            register_process_metrics()
+            self.metricsServer = MetricsServer(self.METRICS_PORT)
 
 #       import cProfile
 #	self._pr = cProfile.Profile()
 
-    def videoFrame(self, image):
-        self.cv_image = self.cv.imgmsg_to_cv2(image, "rgb8")
-        self.cv_image = cv2.resize(self.cv_image, (self.cv_image.shape[1]/2, self.cv_image.shape[0]/2))
+    # Process one frame of video from ``RosVideo``.
+    def videoFrame(self,
+      # The ROS message header for this frame.
+      header,
+      # The frame, as an RGB NumPy array.
+      image,
+      # The size of ``image`` relative to the full-size frame
+      # sent by the drone.
+      image_scale):
+
+        start = time.time()
+        stamp = header.stamp.to_sec() or start
+        frame_interval = stamp - self._lastStamp if self._lastStamp else None
+        self._lastStamp = stamp
+        # Gaps in the sequence numbers are frames dropped
+        # between the driver and here.
+        seq = header.seq
+        if self._lastSeq is not None and seq > self._lastSeq + 1:
+            self._framesDropped.inc(seq - self._lastSeq - 1)
+        self._lastSeq = seq
+        # While frozen for tuning, ignore new frames. This also
+        # stops calls to ``fly``, so the watchdog hovers the
+        # drone.
+        if self.cbFreeze.isChecked():
+            return
+        # Skip frames beyond the rate the power mode allows.
+        power_mode = self.powerGovernor.update(stamp,
+          self.controller.status, self.controller.batteryPercent)
+        if not self.powerGovernor.should_process(stamp):
+            self._framesThrottled.inc()
+            return
+
+        # Compute sizes relative to the full-size frame.
+        width = image.shape[1]/image_scale
+        height = image.shape[0]/image_scale
+        self._displaySize = display_size = (
+          int(round(width*self.DISPLAY_SCALE)),
+          int(round(height*self.DISPLAY_SCALE)))
+        # Don't enlarge frames which were decoded at reduced size.
+        scale = min(self.resolutionGovernor.scale, image_scale)
+        size = (int(round(width*scale)), int(round(height*scale)))
+        if size == (image.shape[1], image.shape[0]):
+            self.cv_image = image
+        else:
+            self.cv_image = cv2.resize(image, size)
+        # Only compute the intermediate image being displayed.
+        debug_view = self._debugView()
+        # A new tracking color, threshold, scale, or view
+        # invalidates the previous result, even if the scene
+        # hasn't changed.
+        thresh = self.hsThreshold.value()/100.0
+        params = (thresh, tuple(self.trackingColor), scale, debug_view)
+        reset = params != self._findCarParams
+        if reset:
+            self._findCarParams = params
+            self.motionGate.reset()
+            if self.flowTracker:
+                self.flowTracker.reset()
+        processed = self.motionGate.changed(self.cv_image)
+        proc_time = None
+        if self.visionProcess and not (self.visionProcess.alive and
+          self.visionProcess.ring.fits(self.cv_image.shape)):
+            # Fall back to processing frames here.
+            self.controller.transport.logwarn('The vision process '
+              'exited or the frames outgrew it; processing in the GUI.')
+            self.visionProcess.stop()
+            self.visionProcess = None
+            if self.FLOW_DETECT_INTERVAL > 1:
+                self.flowTracker = FlowTracker(self.FLOW_DETECT_INTERVAL)
+            processed = True
+        if self.visionProcess:
+            # Hand the frame to the vision process, then use
+            # its newest result, if any. If it's too busy to
+            # take this frame, make sure the next is sent.
+            if processed and not self.visionProcess.submit(
+              self.cv_image, stamp, scale, thresh, self.trackingColor,
+              debug_view, power_mode.features, reset):
+                self.motionGate.reset()
+            unchanged = not processed
+            result = self.visionProcess.poll()
+            processed = result is not None
+            if processed:
+                cont_image, center_mass, cont_area, proc_time, \
+                  self._findCarStamp, self._findCarScale = result
+                self._findCarResult = (None, cont_image, center_mass,
+                  cont_area)
+                self._resultStamp = self._findCarStamp
+            elif unchanged and not self.visionProcess.pending:
+                # This frame matches the last one processed.
+                self._resultStamp = stamp
+            if self._findCarResult is None:
+                return
+        elif processed:
 #	self._pr.enable()
-        lab_img, cont_image, center_mass, cont_area = find_car(self.cv_image, self.trackingColor, self.hsThreshold.value()/100.0)
+            if self.flowTracker and power_mode.features:
+                self._findCarResult = self.flowTracker.track(self.cv_image, self.trackingColor, thresh, self.VISION_THREADS, debug_view=debug_view)
+            else:
+                self._findCarResult = find_car(self.cv_image, self.trackingColor, thresh, self.VISION_THREADS, debug_view)
+            self._findCarStamp = stamp
+            self._findCarScale = scale
 #	self._pr.disable()
+        if not self.visionProcess:
+            # This frame was processed, or matches the last one
+            # processed.
+            self._resultStamp = stamp
+        view_image, cont_image, center_mass, cont_area = self._findCarResult
 #	self._pr.print_stats('cumtime')
 
-        qi = QImage(cont_image.data, cont_image.shape[1], cont_image.shape[0], QImage.Format_RGB888)
+        # Convert the result to the display coordinate frame.
+        self.videoRatio = ratio = self.DISPLAY_SCALE/self._findCarScale
+        if ratio != 1.0:
+            if center_mass != (-1, -1):
+                center_mass = (center_mass[0]*ratio, center_mass[1]*ratio)
+            cont_area *= ratio**2
+        # Correct the center for lens distortion, if the current
+        # camera is calibrated; see ``camera_model``.
+        lens = camera_model(self.controller.cameraChannel)
+        if lens and center_mass != (-1, -1):
+            center_mass = lens.undistort_point(center_mass[0],
+              center_mass[1], display_size)
+        display_image = self._displayImage(view_image, cont_image)
+        if lens and self.UNDISTORT_DISPLAY:
+            display_image = lens.undistort_image(display_image)
+        if processed:
+            if proc_time is None:
+                proc_time = time.time() - start
+            self._framesProcessed.inc()
+            self._frameSeconds.observe(proc_time)
+            self.resolutionGovernor.update(proc_time, frame_interval,
+              cont_area/float(display_size[0]*display_size[1]))
+        else:
+            self._framesSkipped.inc()
 
-        self.lbVideo.setFixedHeight(cont_image.shape[0])
-        self.lbVideo.setFixedWidth(cont_image.shape[1])
-        self.lbVideo.setPixmap(QPixmap.fromImage(qi))
+        # ``lbVideo`` is a ``video_widget.VideoDisplay``.
+        self.lbVideo.setFrame(display_image)
+        if self.overlayStream:
+            if view_image is not None:
+                display_image = self._displayImage(None, cont_image)
+            self.overlayStream.publish(display_image, center_mass, cont_area)
 
         x_center = center_mass[0]
         y_center = center_mass[1]
+        # Report where a level camera would have seen the
+        # center, so ``fly`` doesn't chase the drone's own
+        # pitch and roll.
+        if self.ATTITUDE_COMPENSATION and center_mass != (-1, -1):
+            attitude = self.controller.navdata.nearest(
+              self._findCarStamp,
+              self.ATTITUDE_MAX_AGE)
+            if attitude:
+                roll, pitch = attitude
+                x_center, y_center = level_position(x_center, y_center,
+                  roll, pitch, display_size, self.CAMERA_FOV_X,
+                  self.CAMERA_ROLL_SIGN, self.CAMERA_PITCH_SIGN)
+                # Keep the center within the image, as ``fly``
+                # expects.
+                x_center = min(max(x_center, 0), display_size[0] - 1)
+                y_center = min(max(y_center, 0), display_size[1] - 1)
 
         if self.cbAuto.isChecked():
-            self.fly(x_center, y_center, cont_area)
+            # If vision has stalled, stop flying on its old
+            # result and let the watchdog hover the drone.
+            if (stamp - self._resultStamp <=
+                self.controller.WATCHDOG_DEADLINE/1000.0):
+                self.fly(x_center, y_center, cont_area)
+                self.controller.FeedWatchdog()
+            else:
+                self.lbAuto.setText('Vision stalled.')
+            fly_state = getattr(self, 'state', -1)
         else:
             self.lbAuto.setText('Disabled.')
+            self.controller.DisarmWatchdog()
+            fly_state = -1
+
+        if self.flightLog:
+            self.flightLog.log(start, (x_center, y_center), cont_area, fly_state,
+              self.controller.command, self.controller.status)
 
     def fly(self, x_center, y_center, cont_area):
         pass
 
+    # Return the name of the intermediate image selected for
+    # display (see ``webcam_find_car.DEBUG_VIEWS``), or None
+    # for the overlay.
+    def _debugView(self):
+        debug_view = DEBUG_VIEWS[self.cbDebugView.currentIndex()]
+        return None if debug_view == 'overlay' else debug_view
+
+    # Return the image to display at the display scale: the
+    # intermediate ``view_image`` if given, otherwise the
+    # overlay ``cont_image``.
+    def _displayImage(self, view_image, cont_image):
+        image = cont_image
+        if view_image is not None:
+            image = debug_view_to_rgb(view_image)
+        if self.videoRatio != 1.0:
+            image = cv2.resize(image, self._displaySize,
+              interpolation=cv2.INTER_NEAREST)
+        return image
+
+    # Freeze-frame tuning
+    # -------------------
+    # While ``cbFreeze`` is checked, the last frame stays on
+    # screen, and changing the threshold, tracking color or
+    # debug view reprocesses only that frame. Its distance map
+    # is cached, so moving the threshold slider reruns only
+    # the threshold, morphology and contour steps; picking a
+    # new color reruns only the distance step.
+    @pyqtSlot(bool)
+    def on_cbFreeze_toggled(self, checked):
+        self._frozenDistance = None
+        if checked:
+            self._tuneFrozenFrame()
+        else:
+            # Process the next live frame in full.
+            self.motionGate.reset()
+
+    @pyqtSlot(int)
+    def on_hsThreshold_valueChanged(self, value):
+        self._tuneFrozenFrame()
+
+    @pyqtSlot(int)
+    def on_cbDebugView_currentIndexChanged(self, index):
+        self._tuneFrozenFrame()
+
+    def _tuneFrozenFrame(self):
+        if not self.cbFreeze.isChecked() or self.cv_image is None:
+            return
+        if self._frozenDistance is None:
+            self._frozenDistance = color_distance_map(self.cv_image,
+              self.trackingColor, self.VISION_THREADS)
+        view_image, cont_image, center_mass, cont_area = \
+          find_car_from_distance(self.cv_image, self._frozenDistance,
+          self.hsThreshold.value()/100.0, self.VISION_THREADS,
+          self._debugView())
+        self.lbVideo.setFrame(self._displayImage(view_image, cont_image))
+
+    # Stop background work when the GUI closes.
+    def shutdown(self):
+        if self.visionProcess:
+            self.visionProcess.stop()
+        if self.overlayStream:
+            self.overlayStream.shutdown()
+        if self.flightLog:
+            self.flightLog.close()
+        if self.metricsServer:
+            self.metricsServer.shutdown()
+
     # On a mouse press, select a tracking color.
     def mousePressEvent(self, QMouseEvent):
         x = QMouseEvent.x() - self.lbVideo.x()
         y = QMouseEvent.y() - self.lbVideo.y()
         # Only pick a color if the mouse click lies inside the image.
-	if x >= 0 and y >= 0 and x < self.lbVideo.width() and y < self.lbVideo.height():
+	if self.cv_image is not None and x >= 0 and y >= 0 and x < self.lbVideo.width() and y < self.lbVideo.height():
+            # Convert from display to processing coordinates.
+            y = min(int(y/self.videoRatio), self.cv_image.shape[0] - 1)
+            x = min(int(x/self.videoRatio), self.cv_image.shape[1] - 1)
             self.trackingColor = np.array(self.cv_image[y, x], dtype=np.float32)/255.0
+            # A new color needs a new distance map.
+            self._frozenDistance = None
+            self._tuneFrozenFrame()
 
 
+# Receive video from the drone, emitting ``videoFrame`` with
+# each frame's header, the frame as an RGB NumPy array, and
+# the frame's size relative to full size.
+#
+# Raw video sends every pixel across the ROS socket, only for
+# ``ButtonGui`` to discard most of them. Compressed video
+# sends a JPEG instead, which is decoded straight to half or
+# quarter size (much faster than a full decode followed by a
+# resize). Decoding runs on a worker thread; if frames arrive
+# faster than they can be decoded, only the latest is kept.
 class RosVideo(QObject):
-    videoFrame = pyqtSignal(Image)
+    videoFrame = pyqtSignal(object, object, float)
+
+    # JPEG decode flags for each supported decode scale.
+    DECODE_FLAGS = {
+      1.0: cv2.IMREAD_COLOR,
+      0.5: cv2.IMREAD_REDUCED_COLOR_2,
+      0.25: cv2.IMREAD_REDUCED_COLOR_4,
+    }
+
+    def __init__(self,
+      # The ``transport`` used to receive video; by default,
+      # ROS.
+      transport=None,
+      # True to subscribe to compressed video.
+      compressed=False,
+      # For compressed video, the scale at which to decode
+      # frames; one of the keys of ``DECODE_FLAGS``.
+      decode_scale=0.5):
 
-    def __init__(self):
         QObject.__init__(self)
+        self.transport = transport or RospyTransport()
+        self.compressed = compressed
+        self.decode_scale = decode_scale
+        self._decode_flag = self.DECODE_FLAGS[decode_scale]
+        self.cv = CvBridge()
+        self._framesReceived = REGISTRY.counter(
+          'vision_frames_received_total',
+          'Frames received on /ardrone/image_raw.')
+        # The latest compressed frame waiting to be decoded.
+        self._pending = None
+        self._cond = threading.Condition()
+        self._running = False
 
     def run(self):
-        self.sub = rospy.Subscriber('/ardrone/image_raw',
-          Image, self.videoFrame.emit, queue_size=1)
-
-
-# Setup the application
-def main(gui=ButtonGui):
-
-    rospy.init_node("visual_processor", anonymous=True)
+        if self.compressed:
+            self._running = True
+            self._decoder = threading.Thread(target=self._decode_loop)
+            self._decoder.daemon = True
+            self._decoder.start()
+            self.sub = self.transport.subscriber('/ardrone/image_raw/compressed',
+              CompressedImage, self._receive_compressed, queue_size=1)
+        else:
+            self.sub = self.transport.subscriber('/ardrone/image_raw',
+              Image, self._receive, queue_size=1)
+
+    # Stop receiving and decoding video.
+    def stop(self):
+        self.sub.unregister()
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def _receive(self, image):
+        self._framesReceived.inc()
+        self.videoFrame.emit(image.header,
+          self.cv.imgmsg_to_cv2(image, "rgb8"), 1.0)
+
+    def _receive_compressed(self, image):
+        self._framesReceived.inc()
+        with self._cond:
+            self._pending = image
+            self._cond.notify()
+
+    def _decode_loop(self):
+        while True:
+            with self._cond:
+                while self._running and self._pending is None:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                image, self._pending = self._pending, None
+            bgr = cv2.imdecode(np.frombuffer(image.data, np.uint8),
+              self._decode_flag)
+            if bgr is not None:
+                self.videoFrame.emit(image.header,
+                  cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), self.decode_scale)
+
+
+# Setup the application. Pass a ``transport.FakeBus`` as the
+# ``transport`` to run without ROS.
+def main(gui=ButtonGui, transport=None):
+
+    transport = transport or RospyTransport()
+    transport.init_node("visual_processor", anonymous=True)
 
     app = QApplication(sys.argv)
-    window = gui()
+    window = gui(transport)
     window.show()
 
-    rv = RosVideo()
+    rv = RosVideo(transport, gui.VIDEO_COMPRESSED, gui.VIDEO_DECODE_SCALE)
     rv.videoFrame.connect(window.videoFrame)
     rv.run()
 
@@ -128,7 +616,8 @@ def main(gui=ButtonGui):
 
     # Stop receiving messages when the windows closes; otherwise,
     # see segfaults.
-    rv.sub.unregister()
+    rv.stop()
+    window.shutdown()
     sys.exit(status)
 
 if __name__=='__main__':
@@ -0,0 +1,189 @@
+# .. -*- coding: utf-8 -*-
+#
+# ************************************************************
+# metrics.py - Process-level metrics for outside monitoring
+# ************************************************************
+# This module collects counters, gauges and histograms which describe the running node -- frames received, dropped and processed, command and navdata rates, time spent in each ``DroneStatus``, CPU and memory use -- then serves them over HTTP in the `Prometheus text format <https://prometheus.io/docs/instrumenting/exposition_formats/>`_, which standard scrapers read.
+#
+# Updating a metric is a single attribute update, so it costs next to nothing on the hot path. Rates (frames per second, for example) aren't computed here; scrapers derive them from the counters. Expensive values such as CPU time are gauges whose value is computed by a function only when scraped.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+import os
+import resource
+import threading
+from bisect import bisect_left
+#
+# Local imports
+# -------------
+from http_server import BaseHTTPRequestHandler, ThreadingHTTPServer
+#
+#
+# Metric types
+# ============
+# A value which only increases, such as the number of frames received. Increments aren't locked: under the GIL, a concurrent increment from two threads may very rarely be lost, which is acceptable for monitoring.
+class Counter(object):
+    TYPE = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [('', self.value)]
+
+# A value which may go up or down. If ``function`` is given, it's called to get the value each time the metric is scraped.
+class Gauge(object):
+    TYPE = 'gauge'
+
+    def __init__(self, function=None):
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        return [('', self.function() if self.function else self.value)]
+
+# Counts observations (such as frame processing times) falling in each of a set of buckets.
+class Histogram(object):
+    TYPE = 'histogram'
+    # Default buckets, in seconds, suited to per-frame timings.
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket, plus one for observations larger than every bucket. Counts aren't cumulative until scraped.
+        self.counts = [0]*(len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        samples = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            samples.append(('_bucket', total, ('le', _format_value(bound))))
+        samples.append(('_sum', self.sum))
+        samples.append(('_count', total))
+        return samples
+#
+#
+# Registry
+# ========
+# Holds every metric, grouped into families which share a name and help string but differ in their labels.
+class Registry(object):
+    def __init__(self):
+        # Maps name to (help, {labels: metric}).
+        self._families = {}
+        self._lock = threading.Lock()
+
+    # Return the counter with the given name and labels, creating it if needed. Look metrics up once and keep them, rather than calling this on the hot path.
+    def counter(self, name, help, **labels):
+        return self._get(name, help, Counter, labels)
+
+    def gauge(self, name, help, function=None, **labels):
+        return self._get(name, help, lambda: Gauge(function), labels)
+
+    def histogram(self, name, help, buckets=Histogram.BUCKETS, **labels):
+        return self._get(name, help, lambda: Histogram(buckets), labels)
+
+    def _get(self, name, help, factory, labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            metrics = self._families.setdefault(name, (help, {}))[1]
+            metric = metrics.get(key)
+            if metric is None:
+                metric = metrics[key] = factory()
+            return metric
+
+    # Return all metrics in the Prometheus text format.
+    def render(self):
+        lines = []
+        with self._lock:
+            families = [(name, help, list(metrics.items()))
+              for name, (help, metrics) in sorted(self._families.items())]
+        for name, help, metrics in families:
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, metrics[0][1].TYPE))
+            for labels, metric in metrics:
+                for sample in metric.samples():
+                    suffix, value = sample[:2]
+                    sample_labels = labels + sample[2:]
+                    label_str = ','.join('{}="{}"'.format(k, v)
+                      for k, v in sample_labels)
+                    lines.append('{}{}{} {}'.format(name, suffix,
+                      '{' + label_str + '}' if label_str else '',
+                      _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+# The registry used by this program.
+REGISTRY = Registry()
+#
+#
+# Process metrics
+# ===============
+# Add gauges for the CPU time and resident memory of this process, computed only when scraped.
+def register_process_metrics(registry=REGISTRY):
+    def cpu_seconds():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    page_size = resource.getpagesize()
+    def resident_bytes():
+        # ``/proc/self/statm`` gives the current RSS on Linux; otherwise, fall back to the peak RSS, which ``getrusage`` reports in kilobytes on Linux.
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1])*page_size
+        except (IOError, OSError):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+    registry.gauge('process_cpu_seconds_total',
+      'Total user and system CPU time spent in seconds.', cpu_seconds)
+    registry.gauge('process_resident_memory_bytes',
+      'Resident memory size in bytes.', resident_bytes)
+#
+#
+# HTTP endpoint
+# =============
+# Serve ``registry`` at ``http://host:port/metrics`` on a background thread. The default host only accepts local connections.
+class MetricsServer(object):
+    def __init__(self, port, registry=REGISTRY, host='127.0.0.1'):
+        self._httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self._httpd.registry = registry
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Don't log every scrape to stderr.
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,170 @@
+# .. -*- coding: utf-8 -*-
+#
+# ********************************************************************
+# mjpeg_server.py - Stream the tracking overlay to a web browser
+# ********************************************************************
+# Viewing ``lbVideo`` over X forwarding is unusable on a Wi-Fi link. Instead, this module provides a small HTTP server which a ground station can view with any web browser:
+#
+# - ``/`` shows a page displaying the stream.
+# - ``/stream`` serves the overlay image produced by :func:`webcam_find_car.draw_car_contour` as an MJPEG stream.
+# - ``/result.json`` returns the latest tracking result.
+#
+# JPEG encoding runs on a background thread, and only while at least one client is watching the stream. If frames arrive faster than they can be encoded, only the latest is kept.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+import json
+import threading
+import time
+#
+# Third-party imports
+# -------------------
+import cv2
+#
+# Local imports
+# -------------
+from http_server import BaseHTTPRequestHandler, ThreadingHTTPServer
+#
+#
+# OverlayStreamServer
+# ===================
+class OverlayStreamServer(object):
+    # The boundary string separating JPEG images in the MJPEG stream.
+    BOUNDARY = 'mjpegframe'
+
+    def __init__(self,
+      # The TCP port to listen on.
+      port,
+      # The JPEG quality, from 0 to 100.
+      quality=80,
+      # The interface to listen on; the default listens on all interfaces.
+      host=''):
+
+        self.quality = quality
+        # The number of clients currently watching ``/stream``.
+        self.clients = 0
+        # The latest overlay image and tracking result passed to ``publish``; ``_frame`` is None once it has been encoded.
+        self._frame = None
+        self._result = {}
+        # The latest JPEG-encoded frame and its sequence number, which increases with each newly-encoded frame.
+        self._jpeg = None
+        self._jpeg_seq = 0
+        # Guards all the state above. Waiting on it wakes the encoder when a new frame arrives, and wakes stream clients when a new JPEG is ready.
+        self._cond = threading.Condition()
+        self._running = True
+
+        self._httpd = ThreadingHTTPServer((host, port), _StreamHandler)
+        self._httpd.stream_server = self
+        self._threads = [
+          threading.Thread(target=self._httpd.serve_forever),
+          threading.Thread(target=self._encode_loop),
+        ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    # Offer a new overlay image (an RGB NumPy array) and its tracking result for streaming. This only stores references, so it's cheap enough to call for every frame; the caller must not modify ``rgb_image`` afterwards.
+    def publish(self, rgb_image, center_mass, cont_area):
+        with self._cond:
+            self._result = {
+              'time': time.time(),
+              'center_mass': [float(center_mass[0]), float(center_mass[1])],
+              'cont_area': float(cont_area),
+            }
+            if self.clients:
+                self._frame = rgb_image
+                self._cond.notify_all()
+
+    # Stop serving and encoding.
+    def shutdown(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    # Encode the latest published frame whenever one is waiting.
+    def _encode_loop(self):
+        while True:
+            with self._cond:
+                while self._running and self._frame is None:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                frame, self._frame = self._frame, None
+
+            # Encode outside the lock, so ``publish`` never waits on the encoder. OpenCV expects BGR channel order.
+            ok, jpeg = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR),
+              [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if ok:
+                with self._cond:
+                    self._jpeg = jpeg.tobytes()
+                    self._jpeg_seq += 1
+                    self._cond.notify_all()
+
+    # Wait for a JPEG newer than sequence number ``seq``, returning (jpeg, seq), or (None, seq) on shutdown.
+    def _wait_jpeg(self, seq):
+        with self._cond:
+            while self._running and self._jpeg_seq == seq:
+                self._cond.wait()
+            if not self._running:
+                return None, seq
+            return self._jpeg, self._jpeg_seq
+
+    def _add_client(self, count):
+        with self._cond:
+            self.clients += count
+
+    def _latest_result(self):
+        with self._cond:
+            return dict(self._result)
+
+class _StreamHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server.stream_server
+        if self.path == '/stream':
+            self._send_stream(server)
+        elif self.path == '/result.json':
+            self._send_body(json.dumps(server._latest_result()).encode('utf-8'),
+              'application/json')
+        elif self.path == '/':
+            self._send_body(b'<html><body><img src="/stream"></body></html>',
+              'text/html')
+        else:
+            self.send_error(404)
+
+    def _send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, server):
+        self.send_response(200)
+        self.send_header('Content-Type',
+          'multipart/x-mixed-replace; boundary=' + server.BOUNDARY)
+        self.end_headers()
+        server._add_client(1)
+        try:
+            seq = server._jpeg_seq
+            while True:
+                jpeg, seq = server._wait_jpeg(seq)
+                if jpeg is None:
+                    return
+                self.wfile.write(('--{}\r\nContent-Type: image/jpeg\r\n'
+                  'Content-Length: {}\r\n\r\n'.format(server.BOUNDARY,
+                  len(jpeg))).encode('ascii'))
+                self.wfile.write(jpeg)
+                self.wfile.write(b'\r\n')
+        except (IOError, OSError):
+            # The client disconnected.
+            pass
+        finally:
+            server._add_client(-1)
+
+    # Don't log every request to stderr.
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,64 @@
+# .. -*- coding: utf-8 -*-
+#
+# *****************************************************************
+# motion_gate.py - Skip image processing for frames which are alike
+# *****************************************************************
+# When the drone hovers over a static scene, consecutive video frames are nearly identical, so running :func:`webcam_find_car.find_car` on each of them produces the same answer over and over. This module provides a cheap change detector: it shrinks each frame to a small thumbnail, then compares that to the thumbnail of the last frame which was fully processed. If no thumbnail cell differs by more than a threshold, the caller can reuse its previous result. Comparing the largest difference, not the mean, means even a small target moving across an otherwise still scene triggers processing; each cell averages many pixels, which keeps sensor noise well below the threshold.
+#
+# Imports
+# =======
+# Third-party imports
+# -------------------
+import cv2
+import numpy as np
+#
+#
+# MotionGate
+# ==========
+class MotionGate(object):
+    # The (width, height) of the thumbnail compared between frames. This is small enough that shrinking and comparing costs a tiny fraction of a full detection, yet large enough to notice a car moving across the frame.
+    THUMB_SIZE = (32, 18)
+
+    def __init__(self,
+      # The largest absolute difference, in 8-bit intensity levels, between any two corresponding thumbnail cells (in any channel) below which a frame is considered unchanged.
+      threshold=10.0,
+      # Force a full recompute after this many frames in a row were skipped, as a safety net against slow drift which never crosses the threshold. Use 0 to process every frame.
+      max_skip=10):
+
+        self.threshold = threshold
+        self.max_skip = max_skip
+        # The number of frames skipped or fully processed. Together, these measure the savings provided by the gate.
+        self.skipped = 0
+        self.processed = 0
+        # The thumbnail of the last processed frame, or None to force processing of the next frame.
+        self._thumb = None
+        # The number of frames skipped since the last processed frame.
+        self._skip_run = 0
+
+    # Return True if ``image`` differs enough from the last processed frame that it should be processed, or False if the previous result may be reused.
+    def changed(self, image):
+        thumb = cv2.resize(image, self.THUMB_SIZE,
+          interpolation=cv2.INTER_AREA).astype(np.int16)
+        if (self._thumb is None or
+            self._thumb.shape != thumb.shape or
+            self._skip_run >= self.max_skip or
+            np.max(np.abs(thumb - self._thumb)) > self.threshold):
+
+            self._thumb = thumb
+            self._skip_run = 0
+            self.processed += 1
+            return True
+
+        self._skip_run += 1
+        self.skipped += 1
+        return False
+
+    # Force the next frame to be processed; call this when anything other than the image (the tracking color or threshold, for example) changes the result.
+    def reset(self):
+        self._thumb = None
+
+    # The fraction of frames skipped so far.
+    @property
+    def skip_ratio(self):
+        total = self.skipped + self.processed
+        return float(self.skipped)/total if total else 0.0
@@ -0,0 +1,127 @@
+# .. -*- coding: utf-8 -*-
+#
+# *****************************************************************
+# power_governor.py - Match vision work to flight state and battery
+# *****************************************************************
+# Flight time is limited by the laptop's battery as much as the drone's, yet there's no need to track at full rate while the drone sits on the ground. This module chooses a processing mode from the drone's status and battery (from navdata) and the host's CPU load and battery:
+#
+# - ``full``: process every frame, with every pipeline feature. Used while the drone flies, if nothing is running low.
+# - ``economy``: process at a reduced rate. Used while flying if either battery is low or the CPU is overloaded.
+# - ``idle``: detect only, at a low rate. Used whenever the drone isn't flying.
+#
+# Each mode change is logged.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+from __future__ import division
+import os
+from multiprocessing import cpu_count
+#
+# Local imports
+# -------------
+from drone_status import DroneStatus
+#
+#
+# Modes
+# =====
+class PowerMode(object):
+    def __init__(self, name,
+      # The most frames to process per second, or None for every frame.
+      rate,
+      # True if optional pipeline features (optical flow tracking, for example) may run.
+      features):
+
+        self.name = name
+        self.rate = rate
+        self.features = features
+
+FULL = PowerMode('full', None, True)
+ECONOMY = PowerMode('economy', 10.0, True)
+# The idle rate keeps ``fly`` called often enough that the command watchdog (``BasicDroneController.WATCHDOG_DEADLINE``) won't trip.
+IDLE = PowerMode('idle', 4.0, False)
+
+# Statuses in which the drone is in the air and tracking matters.
+FLYING_STATUSES = (DroneStatus.Flying, DroneStatus.Hovering,
+  DroneStatus.GotoHover, DroneStatus.TakingOff, DroneStatus.Looping)
+#
+#
+# Host state
+# ==========
+# Return the host's CPU load as a fraction of its cores (the one-minute load average divided by the core count), or None if unknown.
+def host_cpu_load():
+    try:
+        return os.getloadavg()[0]/cpu_count()
+    except (AttributeError, OSError):
+        return None
+
+# Return the host's battery charge in percent, or None if it has no battery or is plugged in. This reads Linux's sysfs.
+def host_battery_percent(supply='/sys/class/power_supply/BAT0'):
+    try:
+        with open(os.path.join(supply, 'status')) as f:
+            if f.read().strip() != 'Discharging':
+                return None
+        with open(os.path.join(supply, 'capacity')) as f:
+            return float(f.read())
+    except (IOError, OSError, ValueError):
+        return None
+#
+#
+# PowerGovernor
+# =============
+class PowerGovernor(object):
+    def __init__(self,
+      # A function to log mode changes with.
+      log,
+      # Switch to economy when the drone's or host's battery falls below this percentage.
+      low_battery=25.0,
+      # Switch to economy when the host's CPU load exceeds this fraction of its cores.
+      high_load=0.9,
+      # How often, in seconds, to sample the host's load and battery.
+      host_interval=1.0):
+
+        self.log = log
+        self.low_battery = low_battery
+        self.high_load = high_load
+        self.host_interval = host_interval
+        self.mode = FULL
+        # The latest host samples, and when they were taken.
+        self._host_time = None
+        self._host_load = None
+        self._host_battery = None
+        # The time the last frame was processed.
+        self._last_processed = None
+
+    # Choose the mode, given the current time in seconds and the drone's status and battery percentage.
+    def update(self, now, drone_status, drone_battery):
+        if self._host_time is None or now - self._host_time >= self.host_interval:
+            self._host_time = now
+            self._host_load = host_cpu_load()
+            self._host_battery = host_battery_percent()
+
+        if drone_status not in FLYING_STATUSES:
+            mode, reason = IDLE, 'drone not flying'
+        elif drone_battery is not None and drone_battery < self.low_battery:
+            mode, reason = ECONOMY, 'drone battery at {:.0f}%'.format(drone_battery)
+        elif self._host_battery is not None and self._host_battery < self.low_battery:
+            mode, reason = ECONOMY, 'host battery at {:.0f}%'.format(self._host_battery)
+        elif self._host_load is not None and self._host_load > self.high_load:
+            mode, reason = ECONOMY, 'host CPU load at {:.0%}'.format(self._host_load)
+        else:
+            mode, reason = FULL, 'flying'
+
+        if mode is not self.mode:
+            self.log('Vision power mode {} -> {} ({}).'.format(
+              self.mode.name, mode.name, reason))
+            self.mode = mode
+        return mode
+
+    # Return True if a frame arriving at ``now`` should be processed in the current mode.
+    def should_process(self, now):
+        rate = self.mode.rate
+        if (rate is not None and self._last_processed is not None and
+            0 <= now - self._last_processed < 1.0/rate):
+            return False
+        self._last_processed = now
+        return True
@@ -0,0 +1,92 @@
+# .. -*- coding: utf-8 -*-
+#
+# ***********************************************************************
+# resolution_governor.py - Adapt the vision pipeline's resolution to load
+# ***********************************************************************
+# The cost of :func:`webcam_find_car.find_car` grows with the number of pixels processed. This module chooses, frame by frame, the scale at which to process incoming video: it compares the time spent processing each frame with the interval between incoming frames, reducing the scale when processing can't keep up, and raising it when there's spare time and the tracked blob is small (so that more detail would help).
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+from __future__ import division
+#
+#
+# ResolutionGovernor
+# ==================
+class ResolutionGovernor(object):
+    def __init__(self,
+      # The smallest and largest allowed processing scales, relative to the full incoming frame.
+      min_scale=0.25, max_scale=1.0,
+      # The starting scale.
+      scale=0.5,
+      # The factor by which the scale changes in one step.
+      step=1.25,
+      # The fraction of the frame interval which processing may use.
+      budget=0.8,
+      # A blob covering less than this fraction of the frame is small enough to benefit from a higher resolution. No blob at all counts as small.
+      small_blob=0.01,
+      # The number of frames to wait after a change before changing the scale again, so the timing averages reflect the new scale.
+      hold=10,
+      # The weight given to each new sample in the exponential moving averages of processing time and frame interval.
+      alpha=0.1):
+
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.scale = min(max(scale, min_scale), max_scale)
+        self.step = step
+        self.budget = budget
+        self.small_blob = small_blob
+        self.hold = hold
+        self.alpha = alpha
+        # Averages of processing time and frame interval, in seconds; None until the first sample.
+        self.proc_time = None
+        self.frame_interval = None
+        # Frames remaining before the scale may change again.
+        self._hold_left = hold
+
+    # The fraction of the frame interval spent processing, or None if not yet known.
+    @property
+    def load(self):
+        if not self.proc_time or not self.frame_interval:
+            return None
+        return self.proc_time/self.frame_interval
+
+    # Record one processed frame, then return the scale at which to process the next.
+    def update(self,
+      # The time, in seconds, taken to process the frame at the current scale.
+      proc_time,
+      # The time, in seconds, since the previous incoming frame, or None if unknown.
+      frame_interval,
+      # The fraction of the frame covered by the tracked blob (0 if none was found).
+      blob_fraction):
+
+        self.proc_time = self._average(self.proc_time, proc_time)
+        if frame_interval and frame_interval > 0:
+            self.frame_interval = self._average(self.frame_interval, frame_interval)
+
+        load = self.load
+        if self._hold_left > 0:
+            self._hold_left -= 1
+        elif load is not None:
+            if load > self.budget:
+                self._set_scale(self.scale/self.step)
+            # Processing cost grows with the number of pixels, as the square of the scale; only step up if the larger frame would still fit within the budget.
+            elif (load*self.step**2 < self.budget and
+                  blob_fraction < self.small_blob):
+                self._set_scale(self.scale*self.step)
+
+        return self.scale
+
+    def _set_scale(self, scale):
+        scale = min(max(scale, self.min_scale), self.max_scale)
+        if scale != self.scale:
+            # Assume time scales with the number of pixels until new measurements arrive.
+            self.proc_time *= (scale/self.scale)**2
+            self.scale = scale
+            self._hold_left = self.hold
+
+    def _average(self, average, sample):
+        if average is None:
+            return sample
+        return average + self.alpha*(sample - average)
@@ -0,0 +1,212 @@
+# .. -*- coding: utf-8 -*-
+#
+# **********************************************************
+# transport.py - Message transports: ROS or an in-process bus
+# **********************************************************
+# ``BasicDroneController``, ``RosVideo`` and ``main`` send and receive messages through a transport rather than calling ``rospy`` directly. There are two transports:
+#
+# - :class:`RospyTransport` passes everything to ``rospy``; this is the default.
+# - :class:`FakeBus` delivers messages within this process, without serializing them, and keeps time with a virtual clock which only moves when told to. It records the virtual time of every message published, so latencies (from a frame to the command it causes, for example) can be measured deterministically. With it, the controller and video pipeline run without a roscore or even ``rospy``; ``bus_benchmark`` floods them with synthetic navdata and frames this way.
+#
+# Imports
+# =======
+# Library imports
+# ---------------
+import heapq
+import itertools
+#
+#
+# RospyTransport
+# ==============
+class RospyTransport(object):
+    # ``rospy`` is imported only when this transport is used, so that ``FakeBus`` works where ROS isn't installed.
+    def __init__(self):
+        import rospy
+        self.rospy = rospy
+
+    def init_node(self, name, anonymous=False):
+        self.rospy.init_node(name, anonymous=anonymous)
+
+    def publisher(self, topic, msg_type, queue_size=None):
+        return self.rospy.Publisher(topic, msg_type, queue_size=queue_size)
+
+    def subscriber(self, topic, msg_type, callback, queue_size=None):
+        return self.rospy.Subscriber(topic, msg_type, callback,
+          queue_size=queue_size)
+
+    def service_proxy(self, name, srv_type):
+        return self.rospy.ServiceProxy(name, srv_type)
+
+    # Call ``callback`` every ``period`` seconds.
+    def timer(self, period, callback):
+        return self.rospy.Timer(self.rospy.Duration(period), callback)
+
+    # The current time, in seconds.
+    def now(self):
+        return self.rospy.get_time()
+
+    def on_shutdown(self, callback):
+        self.rospy.on_shutdown(callback)
+
+    def is_shutdown(self):
+        return self.rospy.is_shutdown()
+
+    def loginfo(self, msg):
+        self.rospy.loginfo(msg)
+
+    def logwarn(self, msg):
+        self.rospy.logwarn(msg)
+#
+#
+# FakeBus
+# =======
+class FakeBus(object):
+    def __init__(self,
+      # The starting time of the virtual clock, in seconds.
+      start_time=0.0):
+
+        self.time = start_time
+        # Maps each topic to a list of its subscribers' callbacks.
+        self.subscribers = {}
+        # Maps each topic to the number of messages published on it, and to the virtual times at which they were published.
+        self.published = {}
+        self.publish_times = {}
+        # Maps service names to the functions which handle them, and lists of the requests made to each service.
+        self.services = {}
+        self.service_calls = {}
+        # A heap of (due_time, sequence, timer); the sequence number breaks ties in creation order.
+        self._timers = []
+        self._sequence = itertools.count()
+        self._shutdown_callbacks = []
+        self._shutdown = False
+        # Messages and warnings logged, in order.
+        self.messages = []
+        self.warnings = []
+
+    def init_node(self, name, anonymous=False):
+        pass
+
+    def publisher(self, topic, msg_type, queue_size=None):
+        return _FakePublisher(self, topic)
+
+    def subscriber(self, topic, msg_type, callback, queue_size=None):
+        self.subscribers.setdefault(topic, []).append(callback)
+        return _FakeSubscriber(self, topic, callback)
+
+    def service_proxy(self, name, srv_type):
+        return _FakeServiceProxy(self, name)
+
+    # Handle calls to service ``name`` with ``handler``, which receives the call's arguments and returns its response. Calls to a service without a handler are recorded, then return None.
+    def advertise_service(self, name, handler):
+        self.services[name] = handler
+
+    def timer(self, period, callback):
+        timer = _FakeTimer(self, period, callback)
+        self._schedule(timer, self.time + period)
+        return timer
+
+    def now(self):
+        return self.time
+
+    def on_shutdown(self, callback):
+        self._shutdown_callbacks.append(callback)
+
+    def is_shutdown(self):
+        return self._shutdown
+
+    def loginfo(self, msg):
+        self.messages.append(msg)
+
+    def logwarn(self, msg):
+        self.warnings.append(msg)
+
+    # Deliver ``msg`` to every subscriber of ``topic``, immediately and on the calling thread.
+    def publish(self, topic, msg):
+        self.published[topic] = self.published.get(topic, 0) + 1
+        self.publish_times.setdefault(topic, []).append(self.time)
+        for callback in list(self.subscribers.get(topic, ())):
+            callback(msg)
+
+    # Move the virtual clock forward by ``seconds``, firing each timer which comes due along the way at its due time.
+    def advance(self, seconds):
+        end = self.time + seconds
+        while self._timers and self._timers[0][0] <= end:
+            due, sequence, timer = heapq.heappop(self._timers)
+            if timer.stopped:
+                continue
+            self.time = due
+            timer.fire()
+            self._schedule(timer, due + timer.period)
+        self.time = end
+
+    # Publish each of ``msgs`` on ``topic``, ``rate`` times per virtual second, firing timers in between. ``make_header``, if given, is called with each message and the current virtual time before it's published (to set a timestamp, for example). Returns the number of messages published.
+    def flood(self, topic, msgs, rate, make_header=None):
+        count = 0
+        for msg in msgs:
+            if make_header:
+                make_header(msg, self.time)
+            self.publish(topic, msg)
+            count += 1
+            self.advance(1.0/rate)
+        return count
+
+    # Run the shutdown callbacks, as ``rospy`` does when the node exits.
+    def shutdown(self):
+        self._shutdown = True
+        for callback in self._shutdown_callbacks:
+            callback()
+
+    def _schedule(self, timer, due):
+        heapq.heappush(self._timers, (due, next(self._sequence), timer))
+
+class _FakePublisher(object):
+    def __init__(self, bus, topic):
+        self.bus = bus
+        self.topic = topic
+
+    def publish(self, msg):
+        self.bus.publish(self.topic, msg)
+
+    def unregister(self):
+        pass
+
+class _FakeSubscriber(object):
+    def __init__(self, bus, topic, callback):
+        self.bus = bus
+        self.topic = topic
+        self.callback = callback
+
+    def unregister(self):
+        self.bus.subscribers[self.topic].remove(self.callback)
+
+class _FakeServiceProxy(object):
+    def __init__(self, bus, name):
+        self.bus = bus
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        self.bus.service_calls.setdefault(self.name, []).append((args, kwargs))
+        handler = self.bus.services.get(self.name)
+        return handler(*args, **kwargs) if handler else None
+
+# Mimics ``rospy.timer.TimerEvent``, in virtual time.
+class _FakeTimerEvent(object):
+    def __init__(self, last, current):
+        self.last_real = self.last_expected = last
+        self.current_real = self.current_expected = current
+        self.last_duration = 0.0
+
+class _FakeTimer(object):
+    def __init__(self, bus, period, callback):
+        self.bus = bus
+        self.period = period
+        self.callback = callback
+        self.stopped = False
+        self._last = None
+
+    def fire(self):
+        self.callback(_FakeTimerEvent(self._last, self.bus.time))
+        self._last = self.bus.time
+
+    def shutdown(self):
+        self.stopped = True
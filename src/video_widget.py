@@ -0,0 +1,65 @@
+# .. -*- coding: utf-8 -*-
+#
+# *****************************************************
+# video_widget.py - A lightweight video display widget
+# *****************************************************
+# Displaying video in a ``QLabel`` means building a ``QImage``, converting it to a ``QPixmap``, then resizing the label, for every frame -- copies and layout work on the GUI thread. :class:`VideoDisplay` instead copies each frame into one reused NumPy buffer which a ``QImage`` wraps, paints that image directly, changes its size only when the frame size changes, and repaints no faster than the display can show, however fast frames arrive.
+#
+# ``mav_control.ui`` uses this widget for ``lbVideo``.
+#
+# Imports
+# =======
+# Third-party imports
+# -------------------
+from PyQt4.QtCore import Qt, QTimer
+from PyQt4.QtGui import QImage, QPainter, QWidget
+import numpy as np
+#
+#
+# VideoDisplay
+# ============
+class VideoDisplay(QWidget):
+    # The maximum rate, in Hz, at which to repaint; most displays refresh at 60 Hz.
+    REFRESH_HZ = 60
+
+    def __init__(self, parent=None):
+        QWidget.__init__(self, parent)
+        # The latest frame passed to ``setFrame``, or None if it's already been copied to ``_buffer``.
+        self._frame = None
+        # The buffer holding the displayed frame, and a ``QImage`` which shares its memory.
+        self._buffer = None
+        self._image = None
+        # Opaque painting skips erasing the background first.
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._refresh)
+        self._timer.start(int(1000/self.REFRESH_HZ))
+
+    # Display an 8-bit RGB image (a NumPy array of shape (height, width, 3)). This only keeps a reference, so it's cheap to call for every frame; the caller must not modify the image afterwards.
+    def setFrame(self, rgb_image):
+        self._frame = rgb_image
+
+    # Copy the latest frame into the buffer and schedule a repaint, at most once per refresh period.
+    def _refresh(self):
+        frame, self._frame = self._frame, None
+        if frame is None:
+            return
+        if self._buffer is None or self._buffer.shape != frame.shape:
+            height, width = frame.shape[:2]
+            self._buffer = np.empty((height, width, 3), np.uint8)
+            self._image = QImage(self._buffer.data, width, height,
+              width*3, QImage.Format_RGB888)
+            # Only change geometry, which triggers layout work, when the frame size changes.
+            self.setFixedSize(width, height)
+        np.copyto(self._buffer, frame)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        if self._image is None:
+            painter.fillRect(self.rect(), self.palette().window())
+            painter.drawText(self.rect(), Qt.AlignLeft | Qt.AlignVCenter,
+              'Loading...')
+        else:
+            painter.drawImage(event.rect(), self._image, event.rect())
+        painter.end()
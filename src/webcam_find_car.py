@@ -17,13 +17,127 @@
 # - Creates a trackbar to allow easy of the :attr:`threshold` used by :func:`find_car`.
 # - Handles mouse clicks by recording the color of the clicked pixel to use with :func:`find_car`.
 #
+# Capture, tracking, and display each run at their own pace: a capture thread keeps only the latest webcam frame, a tracking thread runs :func:`find_car` then ``update`` on the newest frame it hasn't yet seen, and the main thread displays the latest result. So, a slow display never delays tracking, and tracking never makes the webcam buffer stale frames.
+#
 # To do this, we rely on libraries which do most of the work. In particular, the following line provides access to the powerful image-processing routines provided by `OpenCV <docs.opencv.org>`_.
 import cv2
 # OpenCV_ relies heavily on `NumPy <numpy.scipy.org>`_ to manipulate arrays containing image data.
 import numpy as np
 from math import sqrt, pi, sin, cos, atan2, copysign
 from numpy import polyfit
+import threading
+# NumPy and OpenCV release the GIL while they crunch pixels, so a pool of threads (rather than processes) is enough to spread :func:`find_lab_color` across CPU cores without copying the frame.
+from multiprocessing.pool import ThreadPool
+
+
+class WebcamFindCar(object):
+    # The name of the display window.
+    WINDOW = 'Webcam find car'
+    # The rate, in Hz, at which to refresh the display.
+    DISPLAY_HZ = 30
+
+    def __init__(self,
+      # A function called as ``update(rgb_image, mass_center, cont_area)`` with each tracked frame; see :func:`find_car`. It runs on the tracking thread.
+      update,
+      # The index of the webcam to open.
+      camera=0,
+      # The RGB color to track, with each channel from 0 to 1.
+      color=(1, 0, 0),
+      # The initial :attr:`threshold`.
+      threshold=0.25,
+      # The number of threads used by :func:`find_car`.
+      threads=1):
+
+        self.update = update
+        self.camera = camera
+        self.color = np.array(color, dtype=np.float32)
+        # The color threshold passed to :func:`find_car`.
+        self.threshold = threshold
+        self.threads = threads
+        # The number of frames captured and tracked so far.
+        self.captured = 0
+        self.tracked = 0
+        # The latest captured frame, then the latest tracked RGB frame and its overlay. ``captured`` tells the tracking thread whether the captured frame is new.
+        self._frame = None
+        self._rgb_image = None
+        self._overlay = None
+        self._cond = threading.Condition()
+        self._running = False
+
+    # Capture, track, and display until the user presses Esc in the display window.
+    def run(self):
+        capture = cv2.VideoCapture(self.camera)
+        if not capture.isOpened():
+            raise IOError('Unable to open webcam {}.'.format(self.camera))
+        self._running = True
+        threads = [threading.Thread(target=self._capture_loop, args=(capture,)),
+                   threading.Thread(target=self._track_loop)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
 
+        cv2.namedWindow(self.WINDOW)
+        cv2.createTrackbar('Threshold', self.WINDOW,
+          int(round(self.threshold*100)), 100, self._on_threshold)
+        cv2.setMouseCallback(self.WINDOW, self._on_mouse)
+        try:
+            # OpenCV's windows must be used from the main thread.
+            while True:
+                with self._cond:
+                    overlay = self._overlay
+                if overlay is not None:
+                    cv2.imshow(self.WINDOW, cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR))
+                if (cv2.waitKey(int(1000/self.DISPLAY_HZ)) & 0xFF) == 27:
+                    break
+        finally:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+            for thread in threads:
+                thread.join()
+            capture.release()
+            cv2.destroyWindow(self.WINDOW)
+
+    # Keep only the latest webcam frame.
+    def _capture_loop(self, capture):
+        while self._running:
+            ok, image = capture.read()
+            if not ok:
+                break
+            with self._cond:
+                self._frame = image
+                self.captured += 1
+                self._cond.notify_all()
+
+    # Track each new frame, skipping any which arrived while the previous one was being tracked.
+    def _track_loop(self):
+        seen = 0
+        while True:
+            with self._cond:
+                while self._running and self.captured == seen:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                image, seen = self._frame, self.captured
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            view_image, cont_image, mass_center, cont_area = find_car(
+              rgb_image, self.color, self.threshold, self.threads)
+            self.update(rgb_image, mass_center, cont_area)
+            with self._cond:
+                self._rgb_image = rgb_image
+                self._overlay = cont_image
+                self.tracked += 1
+
+    def _on_threshold(self, value):
+        self.threshold = value/100.0
+
+    # Track the color of the clicked pixel.
+    def _on_mouse(self, event, x, y, flags, param):
+        if event == cv2.EVENT_LBUTTONDOWN:
+            with self._cond:
+                image = self._rgb_image
+            if image is not None and y < image.shape[0] and x < image.shape[1]:
+                self.color = np.array(image[y, x], dtype=np.float32)/255.0
 
 # Round f then convert it to an f. f can be a scalar or a tuple.
 def round_int(f):
@@ -31,32 +145,157 @@ def round_int(f):
         return tuple(int(round(x)) for x in f)
     return int(round(f))
 
-# This function finds a color blob (assumed to be the car), outlining it and returning its center.
-def find_car(image, lab_color, thresh):
-    lab_image = image / np.float32(255.0)
-    contours = find_lab_color(lab_image, lab_color, thresh)
+# This function finds a color blob (assumed to be the car), outlining it and returning its center. ``threads`` gives the number of horizontal stripes classified in parallel; see :func:`classify_pixels`. The first value returned is the intermediate image named by ``debug_view`` (one of :data:`DEBUG_VIEWS`), or None; intermediates which aren't requested are never kept.
+def find_car(image, lab_color, thresh, threads=1, debug_view=None):
+    assert(lab_color.dtype == np.float32)
+    open_image, view_image = classify_pixels(image, lab_color, thresh, threads, debug_view)
+    if debug_view == 'opened':
+        view_image = open_image
+    contours = find_contours(open_image)
     cont_image, mass_center, cont_area = draw_car_contour(image, contours)
-    return lab_image, cont_image, mass_center, cont_area
+    return view_image, cont_image, mass_center, cont_area
 
-# This routine takes an image in the Lab color space, a color to find in that image, and a threshold around that color, then returns contours surrounding this color.
-def find_lab_color(lab_image, color, thresh):
+# This routine takes an image in the Lab color space, a color to find in that image, and a threshold around that color, then returns contours surrounding this color. The image may be floating-point, or 8-bit (which is scaled to [0, 1] a stripe at a time, rather than converting the whole frame).
+def find_lab_color(lab_image, color, thresh, threads=1):
     assert(color.dtype == np.float32)
+    open_image, view_image = classify_pixels(lab_image, color, thresh, threads)
+    return find_contours(open_image)
+
+# Find the contours of the image, smooth them, and draw them
+def find_contours(open_image):
+    contours0, hierarchy = cv2.findContours(open_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+#    contours = [cv2.approxPolyDP(cnt, 3, True) for cnt in contours0]
+    contours = contours0
+    return contours
+
+# Debug views
+# -----------
+# The intermediate images which :func:`find_car` can return: ``overlay`` (no intermediate; just the outlined blob), ``distance`` (the squared distance of each pixel from the target color), ``threshold`` (the thresholded distance), and ``opened`` (the threshold after a morphological open).
+DEBUG_VIEWS = ('overlay', 'distance', 'threshold', 'opened')
+
+# Convert an intermediate image returned by :func:`find_car` into an 8-bit RGB image for display. Distances are shown with black for the target color, brightening to white at the largest possible distance.
+def debug_view_to_rgb(view_image):
+    if view_image.dtype != np.uint8:
+        view_image = np.uint8(np.clip(np.sqrt(view_image/3.0)*255.0, 0, 255))
+    return cv2.cvtColor(view_image, cv2.COLOR_GRAY2RGB)
+
+# Pixel classification
+# ====================
+# These steps work on each pixel (or a small neighborhood of it), so they can be run on any horizontal stripe of the image independently. :func:`find_lab_color` runs them through :func:`classify_pixels`.
+#
 # Compute (image - target_color)^2, giving a Euclidian distance between the two.
+def color_distance(lab_image, color):
     diff_image = lab_image - color
-    normsq_image = np.sum(diff_image*diff_image, -1)
+    return np.sum(diff_image*diff_image, -1)
+
 # `cv2.Threshold <http://docs.opencv.org/modules/imgproc/doc/miscellaneous_transformations.html#threshold>`_ the image to select only pixels close to the target color. Convert it from floating-point back to an 8-bit image, since the steps below require 8-bit input.
+def threshold_distance(normsq_image, thresh):
     (retval, thresh_image) = cv2.threshold(normsq_image, thresh**2.0, 255.0, cv2.THRESH_BINARY_INV)
-    thresh_image = np.uint8(thresh_image)
+    return np.uint8(thresh_image)
+
+# The size of the structuring element and the number of erode/dilate iterations used by :func:`open_mask`.
+MORPH_KSIZE = 3
+MORPH_ITERATIONS = 2
+# Each erode or dilate iteration reaches ``MORPH_KSIZE//2`` rows further, so a pixel in the opened mask depends on this many rows above and below it.
+MORPH_HALO = 2*MORPH_ITERATIONS*(MORPH_KSIZE//2)
+
 # Perform a morphological open (`erode <http://docs.opencv.org/modules/imgproc/doc/filtering.html#cv2.erode>`_ then dilate), using `getStructuringElement <http://docs.opencv.org/modules/imgproc/doc/filtering.html#getstructuringelement>`_.
-    sel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-    it = 2
+def open_mask(thresh_image):
+    sel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (MORPH_KSIZE, MORPH_KSIZE))
+    it = MORPH_ITERATIONS
     erode_image = cv2.erode(thresh_image, sel, iterations=it)
-    open_image = cv2.dilate(erode_image, sel, iterations=it)
-# Find the contours of the image, smooth them, and draw them
-    contours0, hierarchy = cv2.findContours(open_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-#    contours = [cv2.approxPolyDP(cnt, 3, True) for cnt in contours0]
-    contours = contours0
-    return contours
+    return cv2.dilate(erode_image, sel, iterations=it)
+
+# Run the color distance, threshold, and morphology steps, returning the opened 8-bit mask. With more than one thread, the image is split into ``threads`` stripes which are classified in parallel; the result is bit-identical to the serial path. 8-bit images are scaled to [0, 1] a stripe at a time.
+#
+# If ``debug_view`` is ``distance`` or ``threshold``, return (open_image, view_image), where the second image is that intermediate; otherwise, return (open_image, None).
+def classify_pixels(lab_image, color, thresh, threads=1, debug_view=None):
+    def distance(stripe):
+        return color_distance(_to_float(stripe), color)
+
+    if debug_view == 'distance':
+        def classify(stripe):
+            normsq_image = distance(stripe)
+            return open_mask(threshold_distance(normsq_image, thresh)), normsq_image
+        return run_striped(classify, lab_image, MORPH_HALO, (np.uint8, np.float32), threads)
+    if debug_view == 'threshold':
+        def classify(stripe):
+            thresh_image = threshold_distance(distance(stripe), thresh)
+            return open_mask(thresh_image), thresh_image
+        return run_striped(classify, lab_image, MORPH_HALO, (np.uint8, np.uint8), threads)
+
+    def classify(stripe):
+        return open_mask(threshold_distance(distance(stripe), thresh))
+    return run_striped(classify, lab_image, MORPH_HALO, np.uint8, threads), None
+
+# Scale 8-bit images to [0, 1]; pass floating-point images through unchanged.
+def _to_float(image):
+    if image.dtype == np.uint8:
+        return image / np.float32(255.0)
+    return image
+
+# Tuning
+# ------
+# When tuning, the same frame is processed over and over with different thresholds or colors. These functions split :func:`find_car` in two, so that a threshold change reruns only the threshold, morphology and contour steps on a saved distance map, while a color change reruns only :func:`color_distance_map`.
+#
+# Compute the squared distance of each pixel in ``image`` from ``color``.
+def color_distance_map(image, color, threads=1):
+    assert(color.dtype == np.float32)
+    def distance(stripe):
+        return color_distance(_to_float(stripe), color)
+    return run_striped(distance, image, 0, np.float32, threads)
+
+# Given ``normsq_image`` from :func:`color_distance_map`, finish the work of :func:`find_car`, returning the same results.
+def find_car_from_distance(image, normsq_image, thresh, threads=1, debug_view=None):
+    if debug_view == 'threshold':
+        def classify(stripe):
+            thresh_image = threshold_distance(stripe, thresh)
+            return open_mask(thresh_image), thresh_image
+        open_image, view_image = run_striped(classify, normsq_image, MORPH_HALO, (np.uint8, np.uint8), threads)
+    else:
+        def classify(stripe):
+            return open_mask(threshold_distance(stripe, thresh))
+        open_image = run_striped(classify, normsq_image, MORPH_HALO, np.uint8, threads)
+        view_image = {'distance': normsq_image, 'opened': open_image}.get(debug_view)
+    contours = find_contours(open_image)
+    cont_image, mass_center, cont_area = draw_car_contour(image, contours)
+    return view_image, cont_image, mass_center, cont_area
+
+# Stripe-parallel execution
+# -------------------------
+# Apply ``func`` to ``image``, returning a 2-D array of ``dtype`` with the same number of rows and columns. If ``dtype`` is a tuple, ``func`` returns a tuple of arrays, one per ``dtype``, and so does this function. ``func`` must compute each output pixel from input rows no more than ``halo`` rows away. Each stripe is handed ``halo`` extra rows above and below it, which ``func`` processes but whose results are discarded; this keeps erode/dilate at stripe boundaries seeing the same neighbors as on the whole image.
+def run_striped(func, image, halo, dtype, threads=1):
+    rows = image.shape[0]
+    # Stripes thinner than their halo do more redundant work than useful work.
+    threads = max(1, min(threads, rows//max(1, 2*halo)))
+    if threads == 1:
+        return func(image)
+
+    dtypes = dtype if isinstance(dtype, tuple) else (dtype,)
+    outs = tuple(np.empty(image.shape[:2], d) for d in dtypes)
+    bounds = np.linspace(0, rows, threads + 1).astype(int)
+
+    def run_stripe(i):
+        start, stop = bounds[i], bounds[i + 1]
+        lo = max(0, start - halo)
+        hi = min(rows, stop + halo)
+        results = func(image[lo:hi])
+        if not isinstance(dtype, tuple):
+            results = (results,)
+        for out, result in zip(outs, results):
+            out[start:stop] = result[start - lo:stop - lo]
+
+    _get_pool(threads).map(run_stripe, range(threads))
+    return outs if isinstance(dtype, tuple) else outs[0]
+
+# Thread pools, created on first use and kept for the life of the program, indexed by thread count.
+_pools = {}
+
+def _get_pool(threads):
+    pool = _pools.get(threads)
+    if pool is None:
+        pool = _pools[threads] = ThreadPool(threads)
+    return pool
 
 # Given a contour, outline it and find its center.
 def draw_car_contour(image, contours):
@@ -85,3 +324,8 @@ def compute_mass_center(contour):
     y_m = m01/m00
     return x_m, y_m
 
+# Print the location of the tracked color in each frame.
+if __name__ == '__main__':
+    def update(rgb_image, mass_center, cont_area):
+        print(mass_center, cont_area)
+    WebcamFindCar(update).run()